@@ -0,0 +1,228 @@
+import math as math
+import scipy.stats as stat
+import InputData as Data
+import MarkovModelClasses as MarkovCls
+
+
+class RunningStat:
+    """ running mean and variance of a stream of observations (Welford's algorithm) """
+    def __init__(self, name):
+        """
+        :param name: name of this statistics
+        """
+        self._name = name
+        self._n = 0         # number of observations
+        self._mean = 0      # running mean
+        self._m2 = 0        # running sum of squared deviations from the mean
+
+    def record(self, obs):
+        """ updates the statistics with a new observation
+        :param obs: the new observation
+        """
+        self._n += 1
+        delta = obs - self._mean
+        self._mean += delta / self._n
+        self._m2 += delta * (obs - self._mean)
+
+    def get_n(self):
+        return self._n
+
+    def get_mean(self):
+        return self._mean
+
+    def get_variance(self):
+        if self._n < 2:
+            return math.inf
+        return self._m2 / (self._n - 1)
+
+    def get_t_half_length(self, alpha):
+        """ :returns the half-length of the t-based confidence interval of the mean """
+        if self._n < 2:
+            return math.inf
+        return stat.t.ppf(1 - alpha / 2, self._n - 1) * math.sqrt(self.get_variance() / self._n)
+
+    def get_t_CI(self, alpha):
+        """ :returns the t-based confidence interval of the mean """
+        half_length = self.get_t_half_length(alpha)
+        return [self._mean - half_length, self._mean + half_length]
+
+
+class RunningRatioStat:
+    """ running estimate of the ratio of two means (e.g. ICER = mean increase in cost / mean increase in utility)
+    with a confidence interval calculated by the delta method """
+    def __init__(self, name):
+        """
+        :param name: name of this statistics
+        """
+        self._name = name
+        self._n = 0
+        self._meanX = 0     # running mean of numerators
+        self._meanY = 0     # running mean of denominators
+        self._m2X = 0       # running sum of squared deviations of numerators
+        self._m2Y = 0       # running sum of squared deviations of denominators
+        self._cXY = 0       # running sum of cross deviations
+
+    def record(self, x, y):
+        """ updates the statistics with a new pair of observations
+        :param x: observation of the numerator
+        :param y: observation of the denominator
+        """
+        self._n += 1
+        delta_x = x - self._meanX
+        delta_y = y - self._meanY
+        self._meanX += delta_x / self._n
+        self._meanY += delta_y / self._n
+        self._m2X += delta_x * (x - self._meanX)
+        self._m2Y += delta_y * (y - self._meanY)
+        self._cXY += delta_x * (y - self._meanY)
+
+    def get_ratio(self):
+        if self._meanY == 0:
+            return math.inf
+        return self._meanX / self._meanY
+
+    def get_t_half_length(self, alpha):
+        """ :returns the half-length of the confidence interval of the ratio (delta method) """
+        if self._n < 2 or self._meanY == 0:
+            return math.inf
+
+        ratio = self.get_ratio()
+        var_x = self._m2X / (self._n - 1)
+        var_y = self._m2Y / (self._n - 1)
+        cov_xy = self._cXY / (self._n - 1)
+        var_ratio = (var_x - 2 * ratio * cov_xy + ratio ** 2 * var_y) / (self._meanY ** 2 * self._n)
+
+        return stat.t.ppf(1 - alpha / 2, self._n - 1) * math.sqrt(max(var_ratio, 0))
+
+    def get_relative_t_half_length(self, alpha):
+        """ :returns the half-length of the confidence interval of the ratio relative to the ratio estimate """
+        ratio = self.get_ratio()
+        if ratio == 0:
+            return math.inf
+        return self.get_t_half_length(alpha) / abs(ratio)
+
+
+class AdaptiveComparison:
+    """ simulates cohorts under different therapies in batches until the confidence intervals of the outcomes
+    (and of their increase with respect to the first therapy) reach the target precision specified in InputData
+    or the maximum number of patients is reached """
+    def __init__(self, therapies, batch_size=None, max_pop_size=None):
+        """
+        :param therapies: list of therapies to compare (the first one is the reference therapy)
+        :param batch_size: number of patients simulated in each arm between precision checks
+                           (Data.ADAPTIVE_BATCH_SIZE if not specified)
+        :param max_pop_size: maximum number of patients simulated in each arm
+                             (Data.ADAPTIVE_MAX_POP_SIZE if not specified)
+        """
+        self._batchSize = Data.ADAPTIVE_BATCH_SIZE if batch_size is None else batch_size
+        self._maxPopSize = Data.ADAPTIVE_MAX_POP_SIZE if max_pop_size is None else max_pop_size
+        self._ifConverged = False   # if the target precision is reached
+        # with antithetic variates, every batch should be made of complete pairs of patients
+        if Data.ANTITHETIC_VARIATES and (self._batchSize % 2 == 1 or self._maxPopSize % 2 == 1):
+            raise ValueError('Batch size and maximum population size should be even with antithetic variates.')
+
+        # cohorts (patient ids are spaced by the maximum population size so that cohorts never share an id)
+        self._cohorts = []
+        for i, therapy in enumerate(therapies):
+            self._cohorts.append(MarkovCls.Cohort(id=i, therapy=therapy, pop_size=self._maxPopSize))
+
+        # running statistics of each arm
+        self._costStats = [RunningStat('Patient discounted cost') for t in therapies]
+        self._utilityStats = [RunningStat('Patient discounted utility') for t in therapies]
+        self._survivalStats = [RunningStat('Patient survival time') for t in therapies]
+
+        # running statistics of paired differences with respect to the reference therapy
+        self._diffCostStats = [RunningStat('Increase in discounted cost') for t in therapies[1:]]
+        self._diffUtilityStats = [RunningStat('Increase in discounted utility') for t in therapies[1:]]
+        self._diffSurvivalStats = [RunningStat('Increase in survival time') for t in therapies[1:]]
+        self._icerStats = [RunningRatioStat('ICER') for t in therapies[1:]]
+
+    def simulate(self):
+        """ simulates the cohorts in batches until the target precision or the maximum population size is reached
+        :returns list of cohort outputs (one per therapy)
+        """
+
+        n = 0   # number of patients simulated in each arm
+        while n < self._maxPopSize and not self._ifConverged:
+
+            # simulate the next batch of patients in every arm
+            n_batch = min(self._batchSize, self._maxPopSize - n)
+            batches = []
+            for cohort in self._cohorts:
+                cohort.simulate_batch(n_batch)
+                batches.append(cohort.get_patients_in_range(n, n + n_batch))
+            n += n_batch
+
+            # update the running estimates and check the precision
+            self._record(batches)
+            self._ifConverged = self._get_if_precise()
+
+        # return the cohort outputs
+        return [MarkovCls.CohortOutputs(cohort) for cohort in self._cohorts]
+
+    def _record(self, batches):
+        """ updates the running statistics with a batch of simulated patients from each arm
+        (with antithetic variates, costs and utilities are recorded as averages over each pair of patients) """
+
+        group_size = 2 if Data.ANTITHETIC_VARIATES else 1
+        for j in range(0, len(batches[0]), group_size):
+            ref_group = batches[0][j:j + group_size]
+
+            for i, batch in enumerate(batches):
+                group = batch[j:j + group_size]
+                cost = sum(p.get_total_discounted_cost() for p in group) / len(group)
+                utility = sum(p.get_total_discounted_utility() for p in group) / len(group)
+                self._costStats[i].record(cost)
+                self._utilityStats[i].record(utility)
+                for patient in group:
+                    if patient.get_survival_time() is not None:
+                        self._survivalStats[i].record(patient.get_survival_time())
+
+                # differences with respect to the patients in the same position of the reference arm
+                if i > 0:
+                    diff_cost = cost - sum(p.get_total_discounted_cost() for p in ref_group) / len(ref_group)
+                    diff_utility = utility \
+                        - sum(p.get_total_discounted_utility() for p in ref_group) / len(ref_group)
+                    self._diffCostStats[i-1].record(diff_cost)
+                    self._diffUtilityStats[i-1].record(diff_utility)
+                    self._icerStats[i-1].record(diff_cost, diff_utility)
+                    for patient, ref_patient in zip(group, ref_group):
+                        if patient.get_survival_time() is not None and ref_patient.get_survival_time() is not None:
+                            self._diffSurvivalStats[i-1].record(
+                                patient.get_survival_time() - ref_patient.get_survival_time())
+
+    def _get_if_precise(self):
+        """ :returns True if all specified precision targets are met """
+
+        checks = [
+            (self._costStats, Data.ADAPTIVE_HALF_WIDTH_COST),
+            (self._utilityStats, Data.ADAPTIVE_HALF_WIDTH_UTILITY),
+            (self._survivalStats, Data.ADAPTIVE_HALF_WIDTH_SURVIVAL),
+            (self._diffCostStats, Data.ADAPTIVE_HALF_WIDTH_DIFF_COST),
+            (self._diffUtilityStats, Data.ADAPTIVE_HALF_WIDTH_DIFF_UTILITY),
+            (self._diffSurvivalStats, Data.ADAPTIVE_HALF_WIDTH_DIFF_SURVIVAL),
+        ]
+        for stats, target in checks:
+            if target is not None:
+                for s in stats:
+                    if s.get_t_half_length(Data.ALPHA) > target:
+                        return False
+
+        if Data.ADAPTIVE_ICER_REL_HALF_WIDTH is not None:
+            for s in self._icerStats:
+                if s.get_relative_t_half_length(Data.ALPHA) > Data.ADAPTIVE_ICER_REL_HALF_WIDTH:
+                    return False
+
+        return True
+
+    def get_n_patients(self):
+        """ :returns the number of patients simulated in each arm """
+        return len(self._cohorts[0].get_patients())
+
+    def get_if_converged(self):
+        """ :returns True if the target precision was reached before the maximum population size """
+        return self._ifConverged
+
+    def get_icer_stats(self):
+        """ :returns running ICER statistics of each therapy with respect to the reference therapy """
+        return self._icerStats
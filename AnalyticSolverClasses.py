@@ -0,0 +1,203 @@
+import math as math
+import numpy as np
+import scipy.stats as stat
+import InputData as Data
+import ParameterClasses as P
+import MarkovModelClasses as MarkovCls
+
+# transient (alive) health states of the absorbing chain
+TRANSIENT_STATES = [P.HealthStats.CD4_200to500, P.HealthStats.CD4_200, P.HealthStats.AIDS]
+# states before AIDS (to find the time to AIDS)
+PRE_AIDS_STATES = [P.HealthStats.CD4_200to500, P.HealthStats.CD4_200]
+
+
+class ExpectedOutcomes:
+    """ expected outcomes of patients calculated exactly from the fundamental matrix of the absorbing chain
+    for one or several (e.g. PSA) parameter sets. Outcomes follow the same conventions as the patient simulation
+    (half-cycle correction, discounting) over an infinite horizon, so they differ from the simulation over
+    Data.SIM_LENGTH only by the outcomes of patients still alive at the end of the simulation. """
+    def __init__(self, parameters_list):
+        """
+        :param parameters_list: list of parameter objects with time-homogeneous transition probabilities
+        """
+
+        for param in parameters_list:
+            if param.get_prob_matrix_stack().get_if_time_dependent():
+                raise ValueError('Transition probabilities change over time; '
+                                 'use MarkovModelClasses.get_cohort_trace instead.')
+
+        n = len(parameters_list)
+        t = [s.value for s in TRANSIENT_STATES]
+        pre = [s.value for s in PRE_AIDS_STATES]
+
+        # stack the parameters of all parameter sets
+        prob_matrices = np.array([param.get_prob_matrix_stack().get_prob_matrix(0) for param in parameters_list],
+                                 dtype=float)
+        state_costs = np.array([[param.get_annual_state_cost(s) for s in TRANSIENT_STATES]
+                                for param in parameters_list], dtype=float)
+        state_utilities = np.array([[param.get_annual_state_utility(s) for s in TRANSIENT_STATES]
+                                    for param in parameters_list], dtype=float)
+        treatment_costs = np.array([param.get_annual_treatment_cost() for param in parameters_list], dtype=float)
+        delta_t = np.array([param.get_delta_t() for param in parameters_list], dtype=float)
+        adj_discount_rates = np.array([param.get_adj_discount_rate() for param in parameters_list], dtype=float)
+        initial_states = np.array([param.get_initial_health_state().value for param in parameters_list])
+        rows = np.arange(n)
+
+        # transitions between transient states and probability of staying alive in each step
+        q = prob_matrices[:, t][:, :, t]
+        row_sums = prob_matrices[:, t, :].sum(axis=2)
+        alive_sums = q.sum(axis=2)
+        identity = np.broadcast_to(np.eye(len(t)), q.shape)
+
+        # fundamental matrix: expected number of time steps in each transient state
+        # (time step 0 included) given the initial state
+        fundamental = np.linalg.solve(identity - q, identity)
+        visits = fundamental[rows, initial_states]
+
+        # expected time in each transient state and survival time (death at step k is recorded at (k+0.5)*delta_t)
+        self._timeInStates = visits * delta_t[:, None]
+        self._survivalTimes = (visits.sum(axis=1) - 0.5) * delta_t
+
+        # expected cost and utility of a time step starting in each transient state
+        # (same as PatientCostUtilityMonitor: average of the current and next state, half of the treatment cost
+        # in the time step of death)
+        step_costs = 0.5 * delta_t[:, None] * (state_costs * row_sums + np.einsum('nij,nj->ni', q, state_costs)) \
+            + treatment_costs[:, None] * delta_t[:, None] * (alive_sums + 0.5 * (row_sums - alive_sums))
+        step_utilities = 0.5 * delta_t[:, None] * (
+            state_utilities * row_sums + np.einsum('nij,nj->ni', q, state_utilities))
+
+        # discounted sums over an infinite horizon: the reward of step k is discounted over 2k+1 half steps,
+        # so the values solve (I - beta*Q) v = reward / (1 + r/2) with beta = (1 + r/2)^-2
+        half_step_factor = 1 / (1 + adj_discount_rates / 2)
+        beta = half_step_factor ** 2
+        discounted = np.linalg.solve(identity - beta[:, None, None] * q,
+                                     np.stack([step_costs, step_utilities], axis=2))
+        self._costs = half_step_factor * discounted[rows, initial_states, 0]
+        self._utilities = half_step_factor * discounted[rows, initial_states, 1]
+
+        # time to AIDS: AIDS is treated as absorbing; for patients who develop AIDS at step k
+        # the time is recorded at (k+0.5)*delta_t
+        self._probAIDS = np.full(n, np.nan)
+        self._timesToAIDS = np.full(n, np.nan)
+        if_pre_AIDS = np.isin(initial_states, pre)
+        if if_pre_AIDS.any():
+            q_pre = prob_matrices[:, pre][:, :, pre]
+            to_AIDS = prob_matrices[:, pre, P.HealthStats.AIDS.value]
+            fundamental_pre = np.linalg.solve(np.broadcast_to(np.eye(len(pre)), q_pre.shape) - q_pre,
+                                              np.broadcast_to(np.eye(len(pre)), q_pre.shape))
+            prob_AIDS = np.einsum('nij,nj->ni', fundamental_pre, to_AIDS)
+            # sum over k of k * Q^k = N Q N
+            mean_steps = np.einsum('nij,nj->ni', fundamental_pre @ q_pre @ fundamental_pre, to_AIDS)
+
+            selected = rows[if_pre_AIDS]
+            start = np.searchsorted(pre, initial_states[if_pre_AIDS])
+            self._probAIDS[selected] = prob_AIDS[selected, start]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                self._timesToAIDS[selected] = \
+                    (mean_steps[selected, start] / prob_AIDS[selected, start] + 0.5) * delta_t[selected]
+
+    def get_survival_times(self):
+        """ :returns expected (undiscounted) survival time of each parameter set """
+        return self._survivalTimes
+
+    def get_times_in_states(self):
+        """ :returns (parameter sets x transient states) expected time spent in each transient state """
+        return self._timeInStates
+
+    def get_prob_AIDS(self):
+        """ :returns probability of developing AIDS of each parameter set """
+        return self._probAIDS
+
+    def get_times_to_AIDS(self):
+        """ :returns expected time to AIDS of patients who develop AIDS, for each parameter set """
+        return self._timesToAIDS
+
+    def get_costs(self):
+        """ :returns expected discounted total cost of each parameter set """
+        return self._costs
+
+    def get_utilities(self):
+        """ :returns expected discounted total utility of each parameter set """
+        return self._utilities
+
+
+def get_expected_outcomes(therapy):
+    """ :returns (ExpectedOutcomes) expected outcomes under fixed parameters """
+    return ExpectedOutcomes([P.ParametersFixed(therapy)])
+
+
+def get_expected_outcomes_PSA(therapy, n_draws=None):
+    """ :returns (ExpectedOutcomes) expected outcomes of each PSA parameter draw
+    (draw i has the parameters of the i-th patient of a simulated cohort)
+    :param n_draws: number of parameter draws (Data.POP_SIZE if not specified)
+    """
+    n_draws = Data.POP_SIZE if n_draws is None else n_draws
+    return ExpectedOutcomes([P.ParametersProbabilistic(MarkovCls.Cohort.get_parameter_seed(i), therapy)
+                             for i in range(n_draws)])
+
+
+def get_cross_check(sim_outputs, expected_outcomes, alpha=None):
+    """ compares the outputs of a cohort simulated under fixed parameters to the expected outcomes
+    :returns (dictionary) for each outcome, the expected value, the confidence interval of the simulated mean
+             and if the interval contains the expected value
+    """
+
+    alpha = Data.ALPHA if alpha is None else alpha
+    pairs = {
+        'survival time': (expected_outcomes.get_survival_times(), sim_outputs.get_sumStat_survival_times()),
+        'time to AIDS': (expected_outcomes.get_times_to_AIDS(), sim_outputs.get_sumStat_time_to_AIDS()),
+        'discounted cost': (expected_outcomes.get_costs(), sim_outputs.get_sumStat_discounted_cost()),
+        'discounted utility': (expected_outcomes.get_utilities(), sim_outputs.get_sumStat_discounted_utility()),
+    }
+
+    results = {}
+    for outcome, (expected, sum_stat) in pairs.items():
+        interval = sum_stat.get_t_CI(alpha)
+        results[outcome] = {'expected': float(expected.mean()),
+                            'interval': interval,
+                            'if_within': interval[0] <= float(expected.mean()) <= interval[1]}
+    return results
+
+
+class ControlVariateEstimate:
+    """ estimate of the mean of simulated observations adjusted by a control variate with known mean,
+    e.g. discounted costs of patients adjusted by their survival times and the expected survival time """
+    def __init__(self, name, obs, control_obs, control_mean):
+        """
+        :param name: name of this estimate
+        :param obs: simulated observations
+        :param control_obs: observations of the control variate for the same patients
+        :param control_mean: known mean of the control variate (e.g. from ExpectedOutcomes)
+        """
+        self._name = name
+        obs = np.asarray(obs, dtype=float)
+        control_obs = np.asarray(control_obs, dtype=float)
+        self._n = len(obs)
+
+        # optimal coefficient of the control variate
+        cov = np.cov(obs, control_obs, ddof=1)
+        self._coeff = cov[0, 1] / cov[1, 1] if cov[1, 1] > 0 else 0
+
+        adjusted = obs - self._coeff * (control_obs - control_mean)
+        self._mean = float(adjusted.mean())
+        self._stDev = float(adjusted.std(ddof=1))
+        # variance of the adjusted observations relative to the unadjusted ones
+        self._varianceRatio = self._stDev ** 2 / cov[0, 0] if cov[0, 0] > 0 else 1
+
+    def get_mean(self):
+        return self._mean
+
+    def get_coefficient(self):
+        return self._coeff
+
+    def get_variance_ratio(self):
+        """ :returns variance of the adjusted observations relative to the unadjusted observations """
+        return self._varianceRatio
+
+    def get_t_half_length(self, alpha):
+        # one degree of freedom is used to estimate the coefficient
+        return stat.t.ppf(1 - alpha / 2, self._n - 2) * self._stDev / math.sqrt(self._n)
+
+    def get_t_CI(self, alpha):
+        half_length = self.get_t_half_length(alpha)
+        return [self._mean - half_length, self._mean + half_length]
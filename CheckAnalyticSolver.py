@@ -0,0 +1,29 @@
+import InputData as Data
+import ParameterClasses as P
+import MarkovModelClasses as MarkovCls
+import AnalyticSolverClasses as Analytic
+
+# compare the outcomes of simulated cohorts (with fixed parameters) to the exact expected outcomes
+with P.override_inputs({'PSA_ON': False}):
+    for therapy in P.Therapies:
+
+        simOutputs = MarkovCls.Cohort(id=therapy.value, therapy=therapy).simulate()
+        expectedOutcomes = Analytic.get_expected_outcomes(therapy)
+
+        print(therapy.name)
+        for outcome, check in Analytic.get_cross_check(simOutputs, expectedOutcomes).items():
+            print("  Expected {}: {:.4f}, simulated CI: ({:.4f}, {:.4f}){}".format(
+                outcome, check['expected'], check['interval'][0], check['interval'][1],
+                '' if check['if_within'] else '  <-- outside the confidence interval'))
+
+        # discounted cost adjusted by the survival time as a control variate
+        # (valid when every simulated patient died before the end of the simulation)
+        if len(simOutputs.get_survival_times()) == len(simOutputs.get_costs()):
+            costEstimate = Analytic.ControlVariateEstimate(
+                name='Discounted cost',
+                obs=simOutputs.get_costs(),
+                control_obs=simOutputs.get_survival_times(),
+                control_mean=expectedOutcomes.get_survival_times()[0])
+            print("  Discounted cost with survival time as control variate: {:.0f}, CI: ({:.0f}, {:.0f}), "
+                  "variance ratio: {:.2f}".format(costEstimate.get_mean(), *costEstimate.get_t_CI(alpha=Data.ALPHA),
+                                                   costEstimate.get_variance_ratio()))
@@ -0,0 +1,25 @@
+import ParameterClasses as P
+import MarkovModelClasses as MarkovCls
+import CompactOutcomeClasses as Compact
+
+# Accuracy of the compact mode (Data.COMPACT_OUTPUTS) with respect to the float64 outputs:
+#   - survival times and times to AIDS are stored as cycle indices, so they are exact;
+#   - each cost and utility is rounded to float32 (relative error below 2^-24, about 6e-8);
+#   - means and standard deviations are accumulated in float64, so the rounding errors do not
+#     accumulate with the population size and the relative error of means and confidence interval
+#     bounds stays of the order of 1e-7.
+MAX_RELATIVE_DIFFERENCE = 1e-6
+
+for therapy in P.Therapies:
+
+    # simulate the same cohort with float64 and compact outputs
+    simOutputs = MarkovCls.Cohort(id=therapy.value, therapy=therapy).simulate()
+    with P.override_inputs({'COMPACT_OUTPUTS': True}):
+        compactSimOutputs = MarkovCls.Cohort(id=therapy.value, therapy=therapy).simulate()
+
+    # compare the summary statistics
+    print(therapy.name)
+    for outcome, difference in Compact.get_relative_differences(simOutputs, compactSimOutputs).items():
+        print("  Largest relative difference in the mean and CI of {}: {:.2e}".format(outcome, difference))
+        if difference > MAX_RELATIVE_DIFFERENCE:
+            raise ValueError('Compact outputs of {} are not accurate enough.'.format(outcome))
@@ -0,0 +1,89 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import InputData as Data
+import ParameterClasses as P
+import MarkovModelClasses as MarkovCls
+import ShardedRun as Sharded
+
+# Sharded runs (ShardedRun.py) and runs resumed from checkpoints (Cohort.simulate with a checkpoint_path)
+# should give exactly the same outcomes as simulating the cohort in one go on a single node,
+# since every patient seeds its random number generators from its index in the cohort.
+N_SHARDS = 4
+CHECKPOINT_INTERVAL = 97    # not a divisor of the population size, so the last range is shorter
+
+
+def get_outcomes(sim_outputs):
+    """ :returns the lists of outcomes to compare """
+    return {'survival times': list(sim_outputs.get_survival_times()),
+            'times to AIDS': list(sim_outputs.get_times_to_AIDS()),
+            'discounted costs': list(sim_outputs.get_costs()),
+            'discounted utilities': list(sim_outputs.get_utilities())}
+
+
+def check_identical(name, sim_outputs, ref_sim_outputs):
+    """ raises an error if the outcomes are not identical to the outcomes of the single-node run """
+    ref_outcomes = get_outcomes(ref_sim_outputs)
+    for outcome, values in get_outcomes(sim_outputs).items():
+        if values != ref_outcomes[outcome]:
+            raise ValueError('{} of the {} are different from the single-node run.'.format(outcome, name))
+    print("  {}: identical to the single-node run".format(name))
+
+
+def run_shard_processes(run_directory):
+    """ simulates every shard of a planned run with the command line of ShardedRun.py,
+    in separate Python processes running at the same time """
+
+    # the processes should find the same modules as this process
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+    processes = [subprocess.Popen(
+        [sys.executable, 'ShardedRun.py', 'run-shard', '--dir', run_directory, '--shard', str(shard_index)],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env) for shard_index in range(N_SHARDS)]
+
+    for shard_index, process in enumerate(processes):
+        if process.wait() != 0:
+            raise ValueError('Process of shard {} failed.'.format(shard_index))
+
+
+directory = tempfile.mkdtemp()
+try:
+    for therapy in P.Therapies:
+
+        # single-node run
+        simOutputs = MarkovCls.Cohort(id=therapy.value, therapy=therapy).simulate()
+        print(therapy.name)
+
+        # sharded run (all shards simulated at the same time, each one in a separate process)
+        run_directory = os.path.join(directory, 'sharded_' + therapy.name)
+        Sharded.plan(run_directory, therapy, cohort_id=therapy.value, n_shards=N_SHARDS)
+        changed_run_directory = os.path.join(directory, 'changed_' + therapy.name)
+        Sharded.plan(changed_run_directory, therapy, cohort_id=therapy.value, n_shards=N_SHARDS)
+        run_shard_processes(run_directory)
+        check_identical('sharded run', Sharded.merge(run_directory), simOutputs)
+
+        # run interrupted after its first two checkpoints and then resumed
+        checkpoint_directory = os.path.join(directory, 'checkpoints_' + therapy.name)
+        MarkovCls.Cohort(id=therapy.value, therapy=therapy).simulate(
+            checkpoint_path=checkpoint_directory, checkpoint_interval=CHECKPOINT_INTERVAL)
+        for file_name in sorted(os.listdir(checkpoint_directory))[2:]:
+            os.remove(os.path.join(checkpoint_directory, file_name))
+        resumed_cohort = MarkovCls.Cohort(id=therapy.value, therapy=therapy)
+        check_identical('resumed run', resumed_cohort.simulate(
+            checkpoint_path=checkpoint_directory, checkpoint_interval=CHECKPOINT_INTERVAL), simOutputs)
+
+        # shards and checkpoints should not be combined with patients simulated under a different drug cost
+        with P.override_inputs({'Zidovudine_COST': 2 * Data.Zidovudine_COST}):
+            for name, run in [
+                    ('sharded run', lambda: Sharded.run_shard(changed_run_directory, 0)),
+                    ('resumed run', lambda: MarkovCls.Cohort(id=therapy.value, therapy=therapy).simulate(
+                        checkpoint_path=checkpoint_directory))]:
+                try:
+                    run()
+                except ValueError:
+                    print("  {} with a different drug cost: rejected".format(name))
+                else:
+                    raise ValueError('The {} was not rejected after a drug cost changed.'.format(name))
+finally:
+    shutil.rmtree(directory)
@@ -0,0 +1,183 @@
+import math as math
+import numpy as np
+import scipy.stats as stat
+import InputData as Data
+
+
+class _CompactPatient:
+    """ outcomes of one patient stored in CompactOutcomes """
+    def __init__(self, outcomes, i):
+        self._outcomes = outcomes
+        self._i = i
+
+    def get_survival_time(self):
+        return self._outcomes.get_survival_time(self._i)
+
+    def get_time_to_AIDS(self):
+        return self._outcomes.get_time_to_AIDS(self._i)
+
+    def get_total_discounted_cost(self):
+        return float(self._outcomes.get_costs()[self._i])
+
+    def get_total_discounted_utility(self):
+        return float(self._outcomes.get_utilities()[self._i])
+
+
+class CompactOutcomes:
+    """ outcomes of simulated patients in reduced precision: float32 costs and utilities, and
+    survival time and time to AIDS as the index of the simulation cycle in which they happened
+    (uint16 when the number of cycles allows it). Used in place of the list of patients of a cohort,
+    so simulated patients are not kept in memory. """
+    def __init__(self, capacity=0):
+        """
+        :param capacity: expected number of patients (the arrays grow if more patients are added)
+        """
+        self._n = 0     # number of patients
+        self._deltaT = Data.DELTA_T
+
+        # cycle indices are stored as uint16 unless the simulation has too many cycles
+        if math.ceil(Data.SIM_LENGTH / Data.DELTA_T) < np.iinfo(np.uint16).max:
+            self._cycleType = np.uint16
+        else:
+            self._cycleType = np.uint32
+        self._noCycle = np.iinfo(self._cycleType).max  # marks patients who did not die or develop AIDS
+
+        self._survivalCycles = np.empty(capacity, dtype=self._cycleType)
+        self._AIDSCycles = np.empty(capacity, dtype=self._cycleType)
+        self._costs = np.empty(capacity, dtype=np.float32)
+        self._utilities = np.empty(capacity, dtype=np.float32)
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, i):
+        if not 0 <= i < self._n:
+            raise IndexError('Patient index out of range.')
+        return _CompactPatient(self, i)
+
+    def __iter__(self):
+        for i in range(self._n):
+            yield _CompactPatient(self, i)
+
+    def append(self, patient):
+        """ stores the outcomes of a simulated patient (or of patient outcomes) """
+
+        # grow the arrays if needed
+        if self._n == len(self._costs):
+            capacity = max(2 * self._n, 1024)
+            self._survivalCycles = np.resize(self._survivalCycles, capacity)
+            self._AIDSCycles = np.resize(self._AIDSCycles, capacity)
+            self._costs = np.resize(self._costs, capacity)
+            self._utilities = np.resize(self._utilities, capacity)
+
+        self._survivalCycles[self._n] = self._to_cycle(patient.get_survival_time())
+        self._AIDSCycles[self._n] = self._to_cycle(patient.get_time_to_AIDS())
+        self._costs[self._n] = patient.get_total_discounted_cost()
+        self._utilities[self._n] = patient.get_total_discounted_utility()
+        self._n += 1
+
+    def extend(self, patients):
+        for patient in patients:
+            self.append(patient)
+
+    def _to_cycle(self, time):
+        """ :returns index of the cycle of an event that happened at (k+0.5)*delta_t (half-cycle corrected) """
+        if time is None:
+            return self._noCycle
+        return int(round(time / self._deltaT - 0.5))
+
+    def _to_time(self, cycle):
+        if cycle == self._noCycle:
+            return None
+        return (int(cycle) + 0.5) * self._deltaT
+
+    def get_survival_time(self, i):
+        return self._to_time(self._survivalCycles[i])
+
+    def get_time_to_AIDS(self, i):
+        return self._to_time(self._AIDSCycles[i])
+
+    def get_survival_cycles(self):
+        """ :returns cycle indices of the death of patients who died """
+        cycles = self._survivalCycles[:self._n]
+        return cycles[cycles != self._noCycle]
+
+    def get_AIDS_cycles(self):
+        """ :returns cycle indices of developing AIDS for patients who developed AIDS """
+        cycles = self._AIDSCycles[:self._n]
+        return cycles[cycles != self._noCycle]
+
+    def get_survival_times(self):
+        """ :returns (float64 array) survival times of patients who died """
+        return (self.get_survival_cycles() + 0.5) * self._deltaT
+
+    def get_times_to_AIDS(self):
+        """ :returns (float64 array) times to AIDS of patients who developed AIDS """
+        return (self.get_AIDS_cycles() + 0.5) * self._deltaT
+
+    def get_costs(self):
+        """ :returns (float32 array) discounted total costs """
+        return self._costs[:self._n]
+
+    def get_utilities(self):
+        """ :returns (float32 array) discounted total utilities """
+        return self._utilities[:self._n]
+
+    def get_delta_t(self):
+        return self._deltaT
+
+
+class Float64SummaryStat:
+    """ summary statistics of (reduced-precision) data accumulated in float64;
+    same interface as scr.StatisticalClasses.SummaryStat for means and t-based confidence intervals,
+    but the data are not kept """
+    def __init__(self, name, data):
+        """
+        :param name: name of this statistics
+        :param data: observations
+        """
+        self._name = name
+        self._n = len(data)
+        self._mean = float(np.mean(data, dtype=np.float64)) if self._n > 0 else math.nan
+        self._stDev = float(np.std(data, ddof=1, dtype=np.float64)) if self._n > 1 else math.nan
+
+    def get_mean(self):
+        return self._mean
+
+    def get_stDev(self):
+        return self._stDev
+
+    def get_t_half_length(self, alpha):
+        return stat.t.ppf(1 - alpha / 2, self._n - 1) * self._stDev / math.sqrt(self._n)
+
+    def get_t_CI(self, alpha):
+        half_length = self.get_t_half_length(alpha)
+        return [self._mean - half_length, self._mean + half_length]
+
+
+def get_relative_differences(sim_outputs, compact_sim_outputs, alpha=None):
+    """ compares the summary statistics of a cohort simulated with float64 outputs to
+    the same cohort simulated with compact outputs
+    :returns (dictionary) largest relative difference in the mean and confidence interval bounds of each outcome
+    """
+
+    alpha = Data.ALPHA if alpha is None else alpha
+    pairs = {
+        'survival time': (sim_outputs.get_sumStat_survival_times(),
+                          compact_sim_outputs.get_sumStat_survival_times()),
+        'time to AIDS': (sim_outputs.get_sumStat_time_to_AIDS(),
+                         compact_sim_outputs.get_sumStat_time_to_AIDS()),
+        'discounted cost': (sim_outputs.get_sumStat_discounted_cost(),
+                            compact_sim_outputs.get_sumStat_discounted_cost()),
+        'discounted utility': (sim_outputs.get_sumStat_discounted_utility(),
+                               compact_sim_outputs.get_sumStat_discounted_utility()),
+    }
+
+    differences = {}
+    for outcome, (stat_64, stat_compact) in pairs.items():
+        values_64 = [stat_64.get_mean()] + list(stat_64.get_t_CI(alpha))
+        values_compact = [stat_compact.get_mean()] + list(stat_compact.get_t_CI(alpha))
+        differences[outcome] = max(
+            abs(v_c - v_64) / abs(v_64) if v_64 != 0 else abs(v_c) for v_64, v_c in zip(values_64, values_compact))
+
+    return differences
@@ -0,0 +1,22 @@
+import ParameterClasses as P
+import AdaptiveCohortClasses as AdaptiveCls
+import SupportMarkovModel as SupportMarkov
+
+
+# simulate mono and combination therapy in batches until the target precision is reached
+comparison = AdaptiveCls.AdaptiveComparison(
+    therapies=[P.Therapies.MONO, P.Therapies.COMBO])
+simOutputs_mono, simOutputs_combo = comparison.simulate()
+
+# report the number of patients used
+SupportMarkov.print_adaptive_stopping(comparison)
+
+# print the estimates for the mean survival time and mean time to AIDS
+SupportMarkov.print_outcomes(simOutputs_mono, "Mono Therapy:")
+SupportMarkov.print_outcomes(simOutputs_combo, "Combination Therapy:")
+
+# print comparative outcomes
+SupportMarkov.print_comparative_outcomes(simOutputs_mono, simOutputs_combo)
+
+# report the CEA results
+SupportMarkov.report_CEA_CBA(simOutputs_mono, simOutputs_combo)
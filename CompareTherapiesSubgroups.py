@@ -0,0 +1,28 @@
+import ParameterClasses as P
+import SubgroupCohortClasses as SubgroupCls
+import SupportMarkovModel as SupportMarkov
+
+
+# simulate a heterogeneous cohort (subgroups defined in InputData) under each therapy
+cohort_mono = SubgroupCls.SubgroupCohort(
+    id=0,
+    therapy=P.Therapies.MONO)
+simOutputs_mono = cohort_mono.simulate()
+
+cohort_combo = SubgroupCls.SubgroupCohort(
+    id=1,
+    therapy=P.Therapies.COMBO)
+simOutputs_combo = cohort_combo.simulate()
+
+# print the pooled outcomes
+SupportMarkov.print_outcomes(simOutputs_mono, "Mono Therapy (all subgroups):")
+SupportMarkov.print_outcomes(simOutputs_combo, "Combination Therapy (all subgroups):")
+
+# print the outcomes of each subgroup
+for name, subOutputs_mono, subOutputs_combo in zip(
+        cohort_mono.get_subgroup_names(), cohort_mono.get_subgroup_outputs(), cohort_combo.get_subgroup_outputs()):
+    SupportMarkov.print_outcomes(subOutputs_mono, "Mono Therapy ({}):".format(name))
+    SupportMarkov.print_outcomes(subOutputs_combo, "Combination Therapy ({}):".format(name))
+
+# print pooled comparative outcomes
+SupportMarkov.print_comparative_outcomes(simOutputs_mono, simOutputs_combo)
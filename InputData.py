@@ -6,6 +6,8 @@ ALPHA = 0.05        # significance level for calculating confidence intervals
 DISCOUNT = 0.03     # annual discount rate
 
 ADD_BACKGROUND_MORT = True  # if background mortality should be added
+AGE_DEPENDENT_BACKGROUND_MORT = False   # if background mortality should vary with age (using LIFE_TABLE)
+INITIAL_AGE = 35    # age of the cohort at the start of the simulation (years)
 DELTA_T = 1/4       # years
 
 PSA_ON = True      # if probabilistic sensitivity analysis is on
@@ -42,3 +44,83 @@ TREATMENT_RR_CI = 0.365, 0.71  # lower 95% CI, upper 95% CI
 # annual probability of background mortality (number per year per 1,000 population)
 ANNUAL_PROB_BACKGROUND_MORT = 8.15 / 1000
 
+# annual probability of background mortality by age band (approximate US period life table)
+LIFE_TABLE = [
+    # (lower bound of the age band, annual probability of death)
+    (0,     1.3 / 1000),
+    (5,     0.1 / 1000),
+    (10,    0.1 / 1000),
+    (15,    0.5 / 1000),
+    (20,    0.9 / 1000),
+    (25,    1.1 / 1000),
+    (30,    1.4 / 1000),
+    (35,    1.8 / 1000),
+    (40,    2.5 / 1000),
+    (45,    3.7 / 1000),
+    (50,    5.7 / 1000),
+    (55,    8.5 / 1000),
+    (60,    12.0 / 1000),
+    (65,    16.8 / 1000),
+    (70,    25.4 / 1000),
+    (75,    40.1 / 1000),
+    (80,    65.8 / 1000),
+    (85,    110.0 / 1000),
+    (90,    182.0 / 1000),
+    (95,    280.0 / 1000),
+    (100,   400.0 / 1000),
+    ]
+
+
+# adaptive stopping settings (set a target to None to ignore it)
+ADAPTIVE_BATCH_SIZE = 250               # number of patients simulated in each arm between precision checks
+ADAPTIVE_MAX_POP_SIZE = 100000          # maximum number of patients simulated in each arm
+ADAPTIVE_HALF_WIDTH_COST = 500          # target CI half-width of mean discounted cost ($)
+ADAPTIVE_HALF_WIDTH_UTILITY = 0.05      # target CI half-width of mean discounted utility
+ADAPTIVE_HALF_WIDTH_SURVIVAL = 0.25     # target CI half-width of mean survival time (years)
+ADAPTIVE_HALF_WIDTH_DIFF_COST = 500     # target CI half-width of the increase in discounted cost ($)
+ADAPTIVE_HALF_WIDTH_DIFF_UTILITY = 0.05     # target CI half-width of the increase in discounted utility
+ADAPTIVE_HALF_WIDTH_DIFF_SURVIVAL = 0.25    # target CI half-width of the increase in survival time (years)
+ADAPTIVE_ICER_REL_HALF_WIDTH = 0.1      # target CI half-width of ICER relative to the ICER estimate
+
+# variance reduction settings
+COMMON_RANDOM_NUMBERS = False   # if patients in the same position of every cohort should share random numbers
+ANTITHETIC_VARIATES = False     # if odd patients should use the antithetic (1-u) random numbers (and, under
+                                # PSA, the parameters) of the preceding patient; confidence intervals of costs
+                                # and utilities are then calculated from pair averages (keep population sizes
+                                # even). With either option, patients draw one random number for how long they
+                                # stay in each state and one for the state they move to, so u and 1-u lead to
+                                # a long and a short stay (one number per time step would be wasted: with a
+                                # probability of staying of about 0.9, u and 1-u would mostly both mean 'stay').
+
+# checkpoint settings
+CHECKPOINT_INTERVAL = 10000     # number of patients simulated between checkpoints
+
+# subgroups of a heterogeneous cohort
+SUBGROUPS = [
+    {
+        'name': 'CD4 200-500',
+        'weight': 0.6,                          # share of the cohort
+        'initial_state_dist': [1, 0, 0],        # probability of starting in CD4_200to500, CD4_200, AIDS
+        'overrides': {},                        # parameter inputs that are different for this subgroup
+                                                # (see SubgroupCohortClasses.SUBGROUP_INPUTS)
+    },
+    {
+        'name': 'CD4 < 200',
+        'weight': 0.3,
+        'initial_state_dist': [0, 0.8, 0.2],
+        'overrides': {'ANNUAL_STATE_UTILITY': [0.75, 0.45, 0.25]},
+    },
+    {
+        'name': 'Older, CD4 200-500',
+        'weight': 0.1,
+        'initial_state_dist': [0.9, 0.1, 0],
+        'overrides': {'INITIAL_AGE': 55, 'AGE_DEPENDENT_BACKGROUND_MORT': True},
+    },
+    ]
+
+# compact mode: keep only the outcomes of simulated patients, as float32 costs and utilities and
+# cycle indices of death and AIDS (summary statistics are still accumulated in float64)
+COMPACT_OUTPUTS = False
+
+# if the path of health states of every patient should be recorded (as run-length segments)
+RECORD_TRAJECTORIES = False
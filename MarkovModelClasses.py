@@ -1,25 +1,41 @@
+import os
+import numpy as np
 import scr.SamplePathClasses as PathCls
 import scr.StatisticalClasses as StatCls
 import scr.RandomVariantGenerators as rndClasses
 import scr.EconEvalClasses as EconCls
 import ParameterClasses as P
 import InputData as Data
+import SupportCheckpoint as Checkpoint
+import CompactOutcomeClasses as Compact
+import TrajectoryClasses as Traj
 
 
 class Patient:
-    def __init__(self, id, parameters):
+    def __init__(self, id, parameters, seed=None, if_antithetic=False, initial_state=None, trajectories=None):
         """ initiates a patient
         :param id: ID of the patient
         :param parameters: parameter object
+        :param seed: seed of the random number generator of this patient (id if not specified)
+        :param if_antithetic: if this patient should use the antithetic (1-u) of its random numbers
+        :param initial_state: initial health state (the initial health state of parameters if not specified)
+        :param trajectories: (Trajectories) if specified, the path of this patient is recorded there
         """
 
         self._id = id
+        # seed of the random number generator and if random numbers are antithetic
+        self._seed = id if seed is None else seed
+        self._ifAntithetic = if_antithetic
         # random number generator for this patient
         self._rng = None
+        # with common random numbers or antithetic variates, the patient leaves its current state once the
+        # probability of still being in it drops below this uniform random number (None until it is drawn)
+        self._exitThreshold = None
+        self._probStaying = 1      # probability of still being in the current state
         # parameters
         self._param = parameters
         # state monitor
-        self._stateMonitor = PatientStateMonitor(parameters)
+        self._stateMonitor = PatientStateMonitor(parameters, initial_state, trajectories)
         # simulation time step
         self._delta_t = parameters.get_delta_t()
 
@@ -27,20 +43,27 @@ class Patient:
         """ simulate the patient over the specified simulation length """
 
         # random number generator for this patient
-        self._rng = rndClasses.RNG(self._id)
+        self._rng = rndClasses.RNG(self._seed)
 
         k = 0  # current time step
 
+        # start recording the path of this patient
+        self._stateMonitor.begin_trajectory()
+
         # while the patient is alive and simulation length is not yet reached
         while self._stateMonitor.get_if_alive() and k*self._delta_t < sim_length:
 
-            # find the transition probabilities of the future states
-            trans_probs = self._param.get_transition_prob(self._stateMonitor.get_current_state())
-            # create an empirical distribution
-            empirical_dist = rndClasses.Empirical(trans_probs)
-            # sample from the empirical distribution to get a new state
-            # (returns an integer from {0, 1, 2, ...})
-            new_state_index = empirical_dist.sample(self._rng)
+            if Data.COMMON_RANDOM_NUMBERS or Data.ANTITHETIC_VARIATES:
+                # use two uniform random numbers per visited state to keep the random streams synchronized
+                new_state_index = self._sample_next_state_index(k)
+            else:
+                # find the transition probabilities of the future states
+                trans_probs = self._param.get_transition_prob(self._stateMonitor.get_current_state(), k)
+                # create an empirical distribution
+                empirical_dist = rndClasses.Empirical(trans_probs)
+                # sample from the empirical distribution to get a new state
+                # (returns an integer from {0, 1, 2, ...})
+                new_state_index = empirical_dist.sample(self._rng)
 
             # update health state
             self._stateMonitor.update(k, P.HealthStats(new_state_index))
@@ -48,6 +71,49 @@ class Patient:
             # increment time step
             k += 1
 
+        # stop recording the path of this patient
+        self._stateMonitor.end_trajectory()
+
+    def _sample_next_state_index(self, k):
+        """ samples the next state by inverse CDF: one uniform random number determines the time step at which
+        the patient leaves its current state and another one the state it moves to. u and 1-u then lead to
+        a long and a short stay, so the outcomes of antithetic patients are negatively correlated
+        (with one random number per time step, u and 1-u would both lead to staying in most time steps).
+        :param k: current time step
+        :returns index of the next health state
+        """
+
+        current = self._stateMonitor.get_current_state().value
+        trans_probs = self._param.get_transition_prob(self._stateMonitor.get_current_state(), k)
+
+        # the patient stays while the probability of still being in the current state is above the threshold
+        if self._exitThreshold is None:
+            self._exitThreshold = self._get_uniform()
+            self._probStaying = 1
+        self._probStaying *= trans_probs[current]
+        if self._probStaying > self._exitThreshold:
+            return current
+
+        # the patient leaves: sample the next state from the transition probabilities to the other states
+        self._exitThreshold = None
+        u = self._get_uniform() * (1 - trans_probs[current])
+        cum_prob = 0
+        next_index = current
+        for j, prob in enumerate(trans_probs):
+            if j != current and prob > 0:
+                cum_prob += prob
+                next_index = j
+                if u < cum_prob:
+                    break
+        return next_index
+
+    def _get_uniform(self):
+        """ :returns a uniform random number (or its antithetic) """
+        u = self._rng.random_sample()
+        if self._ifAntithetic:
+            u = 1 - u
+        return u
+
     def get_survival_time(self):
         """ returns the patient's survival time"""
         return self._stateMonitor.get_survival_time()
@@ -67,11 +133,15 @@ class Patient:
 
 class PatientStateMonitor:
     """ to update patient outcomes (years survived, cost, etc.) throughout the simulation """
-    def __init__(self, parameters):
+    def __init__(self, parameters, initial_state=None, trajectories=None):
         """
         :param parameters: patient parameters
+        :param initial_state: initial health state (the initial health state of parameters if not specified)
+        :param trajectories: (Trajectories) if specified, changes of health state are recorded there
         """
-        self._currentState = parameters.get_initial_health_state() # current health state
+        if initial_state is None:
+            initial_state = parameters.get_initial_health_state()
+        self._currentState = initial_state  # current health state
         self._delta_t = parameters.get_delta_t()    # simulation time step
         self._survivalTime = 0          # survival time
         self._timeToAIDS = 0        # time to develop AIDS
@@ -80,6 +150,9 @@ class PatientStateMonitor:
         # monitoring cost and utility outcomes
         self._costUtilityOutcomes = PatientCostUtilityMonitor(parameters)
 
+        # recording the path of health states
+        self._trajectories = trajectories
+
     def update(self, k, next_state):
         """
         :param k: current time step
@@ -102,9 +175,23 @@ class PatientStateMonitor:
         # collect cost and utility outcomes
         self._costUtilityOutcomes.update(k, self._currentState, next_state)
 
+        # record the change of health state
+        if self._trajectories is not None and next_state != self._currentState:
+            self._trajectories.record_transition(k, next_state)
+
         # update current health state
         self._currentState = next_state
 
+    def begin_trajectory(self):
+        """ starts recording the path of health states (if trajectories are recorded) """
+        if self._trajectories is not None:
+            self._trajectories.begin_patient(self._currentState)
+
+    def end_trajectory(self):
+        """ stops recording the path of health states at the end of the simulation """
+        if self._trajectories is not None:
+            self._trajectories.end_patient()
+
     def get_if_alive(self):
         result = True
         if self._currentState in [P.HealthStats.HIV_DEATH, P.HealthStats.BACKGROUND_DEATH]:
@@ -186,42 +273,181 @@ class PatientCostUtilityMonitor:
         return  self._totalDiscountedUtility
 
 
+class PatientOutcomes:
+    """ outcomes of an already simulated patient (e.g. restored from a checkpoint) """
+    def __init__(self, survival_time, time_to_AIDS, cost, utility):
+        self._survivalTime = survival_time
+        self._timeToAIDS = time_to_AIDS
+        self._totalDiscountedCost = cost
+        self._totalDiscountedUtility = utility
+
+    def get_survival_time(self):
+        """ returns the patient's survival time"""
+        return self._survivalTime
+
+    def get_time_to_AIDS(self):
+        """ returns the patient's time to AIDS """
+        return self._timeToAIDS
+
+    def get_total_discounted_cost(self):
+        """ :returns total discounted cost """
+        return self._totalDiscountedCost
+
+    def get_total_discounted_utility(self):
+        """ :returns total discounted utility"""
+        return self._totalDiscountedUtility
+
+
 class Cohort:
-    def __init__(self, id, therapy):
+    def __init__(self, id, therapy, pop_size=None):
         """ create a cohort of patients
         :param id: an integer to specify the seed of the random number generator
+        :param therapy: selected therapy
+        :param pop_size: number of patients to simulate (Data.POP_SIZE if not specified);
+                         patient ids of cohort 'id' start from id * pop_size
         """
-        self._initial_pop_size = Data.POP_SIZE
-        self._patients = []      # list of patients
-
-        # populate the cohort
-        for i in range(self._initial_pop_size):
-            # create a new patient (use id * pop_size + i as patient id)
-            if Data.PSA_ON:
-                patient = Patient(id * self._initial_pop_size + i, P.ParametersProbabilistic(i, therapy))
-            else:
-                patient = Patient(id * self._initial_pop_size + i, P.ParametersFixed(therapy))
-            # add the patient to the cohort
-            self._patients.append(patient)
+        self._id = id
+        self._therapy = therapy
+        if pop_size is None:
+            self._initial_pop_size = Data.POP_SIZE
+        else:
+            self._initial_pop_size = pop_size
+        # simulated patients (in compact mode, only their outcomes are kept in reduced precision)
+        if Data.COMPACT_OUTPUTS:
+            self._patients = Compact.CompactOutcomes(capacity=self._initial_pop_size)
+        else:
+            self._patients = []
+
+        # paths of health states of simulated patients (if recorded)
+        self._trajectories = Traj.Trajectories() if Data.RECORD_TRAJECTORIES else None
+
+    def get_patient_seed(self, i):
+        """ :returns seed of the random number generator of the i-th patient of this cohort """
+
+        # position of the random number stream of this patient
+        # (with antithetic variates, odd patients reuse the stream of the preceding patient)
+        if Data.ANTITHETIC_VARIATES:
+            stream = i - i % 2
+        else:
+            stream = i
+
+        # with common random numbers, patients in the same position of every cohort share the same stream
+        if Data.COMMON_RANDOM_NUMBERS:
+            return stream
+        else:
+            return self._id * self._initial_pop_size + stream
+
+    @staticmethod
+    def get_parameter_seed(i):
+        """ :returns seed of the parameter sample of the i-th patient under PSA
+        (with antithetic variates, both patients of a pair share the same parameters) """
+        if Data.ANTITHETIC_VARIATES:
+            return i - i % 2
+        else:
+            return i
 
-    def simulate(self):
+    def create_patient(self, i):
+        """ :returns the i-th patient of this cohort (not yet simulated) """
+
+        # parameters of this patient
+        if Data.PSA_ON:
+            parameters = P.ParametersProbabilistic(self.get_parameter_seed(i), self._therapy)
+        else:
+            parameters = P.ParametersFixed(self._therapy)
+
+        # create a new patient (use id * pop_size + i as patient id)
+        return Patient(self._id * self._initial_pop_size + i, parameters,
+                       seed=self.get_patient_seed(i), if_antithetic=Data.ANTITHETIC_VARIATES and i % 2 == 1,
+                       trajectories=self._trajectories)
+
+    def simulate(self, checkpoint_path=None, checkpoint_interval=None):
         """ simulate the cohort of patients over the specified number of time-steps
+        :param checkpoint_path: if specified, directory where the outcomes of each range of simulated patients
+                                are saved to a separate file; the simulation resumes from the ranges already
+                                saved in this directory
+        :param checkpoint_interval: number of patients simulated between checkpoints
+                                    (Data.CHECKPOINT_INTERVAL if not specified)
         :returns outputs from simulating this cohort
         """
 
-        # simulate all patients
-        for patient in self._patients:
-            patient.simulate(Data.SIM_LENGTH)
+        if checkpoint_path is None:
+            # simulate all patients
+            self.simulate_batch(self._initial_pop_size - len(self._patients))
+        else:
+            if checkpoint_interval is None:
+                checkpoint_interval = Data.CHECKPOINT_INTERVAL
+            input_hash = self.get_input_hash()
+            os.makedirs(checkpoint_path, exist_ok=True)
+
+            # resume from the saved ranges (each range starts where the previous one ends)
+            if len(self._patients) == 0:
+                while os.path.exists(Checkpoint.get_range_path(checkpoint_path, len(self._patients))):
+                    self.add_patient_outcomes(Checkpoint.load_outcomes(
+                        Checkpoint.get_range_path(checkpoint_path, len(self._patients)), input_hash))
+
+            # simulate the remaining patients and save each batch to its own file
+            while len(self._patients) < self._initial_pop_size:
+                first = len(self._patients)
+                self.simulate_batch(min(checkpoint_interval, self._initial_pop_size - first))
+                Checkpoint.save_outcomes(Checkpoint.get_range_path(checkpoint_path, first),
+                                         self.get_patients_in_range(first, len(self._patients)),
+                                         input_hash, first_patient=first)
 
         # return the cohort outputs
         return CohortOutputs(self)
 
+    def simulate_batch(self, n):
+        """ simulate the next n patients of this cohort and add them to the cohort
+        (each patient is added as soon as it is simulated, so in compact mode only its outcomes are kept)
+        :param n: number of patients to simulate
+        """
+
+        for patient in self.simulate_range(len(self._patients), len(self._patients) + n):
+            self._patients.append(patient)
+
+    def simulate_range(self, first, end):
+        """ simulate patients first, ..., end-1 of this cohort without adding them to the cohort
+        :returns (generator) the simulated patients, one at a time
+        """
+
+        for i in range(first, end):
+            patient = self.create_patient(i)
+            patient.simulate(Data.SIM_LENGTH)
+            yield patient
+
+    def add_patient_outcomes(self, outcomes):
+        """ adds already simulated patients to the cohort
+        :param outcomes: (dictionary) outcomes of patients as returned by SupportCheckpoint.load_outcomes
+                         (the first patient should be the next patient of this cohort)
+        """
+
+        if outcomes['first_patient'] != len(self._patients):
+            raise ValueError('Outcomes should start from patient {}.'.format(len(self._patients)))
+
+        for survival_time, time_to_AIDS, cost, utility in zip(
+                outcomes['survival_times'], outcomes['times_to_AIDS'], outcomes['costs'], outcomes['utilities']):
+            self._patients.append(PatientOutcomes(survival_time, time_to_AIDS, cost, utility))
+
+    def get_input_hash(self):
+        """ :returns hash of the inputs that determine the outcomes of this cohort """
+        return Checkpoint.get_input_hash(cohort_id=self._id, therapy=self._therapy, pop_size=self._initial_pop_size)
+
     def get_initial_pop_size(self):
         return self._initial_pop_size
 
     def get_patients(self):
         return self._patients
 
+    def get_patients_in_range(self, first, end):
+        """ :returns list of simulated patients first, ..., end-1
+        (in compact mode, views of their outcomes) """
+        return [self._patients[i] for i in range(first, end)]
+
+    def get_trajectories(self):
+        """ :returns (Trajectories) paths of health states of the patients simulated by this cohort
+        (in the order they were simulated), or None if trajectories are not recorded """
+        return self._trajectories
+
 
 class CohortOutputs:
     def __init__(self, simulated_cohort):
@@ -233,10 +459,15 @@ class CohortOutputs:
         self._times_to_AIDS = []        # patients' times to AIDS
         self._costs = []                # patients' discounted total costs
         self._utilities =[]             # patients' discounted total utilities
+        self._compactOutcomes = None    # patients' outcomes in reduced precision (in compact mode)
 
         # survival curve
         self._survivalCurve = \
-            PathCls.SamplePathBatchUpdate('Population size over time', id, simulated_cohort.get_initial_pop_size())
+            PathCls.SamplePathBatchUpdate('Population size over time', id, len(simulated_cohort.get_patients()))
+
+        if isinstance(simulated_cohort.get_patients(), Compact.CompactOutcomes):
+            self._extract_compact_outputs(simulated_cohort.get_patients())
+            return
 
         # find patients' survival times
         for patient in simulated_cohort.get_patients():
@@ -259,21 +490,65 @@ class CohortOutputs:
         # summary statistics
         self._sumStat_survivalTime = StatCls.SummaryStat('Patient survival time', self._survivalTimes)
         self._sumState_timeToAIDS = StatCls.SummaryStat('Time until AIDS', self._times_to_AIDS)
-        self._sumStat_cost = StatCls.SummaryStat('Patient discounted cost', self._costs)
-        self._sumStat_utility = StatCls.SummaryStat('Patient discounted utility', self._utilities)
+        self._sumStat_cost = StatCls.SummaryStat('Patient discounted cost', self.get_costs_for_CI())
+        self._sumStat_utility = StatCls.SummaryStat('Patient discounted utility', self.get_utilities_for_CI())
+
+    def _extract_compact_outputs(self, compact_outcomes):
+        """ extracts outputs from outcomes stored in reduced precision (summary statistics are accumulated in float64)
+        :param compact_outcomes: (CompactOutcomes) outcomes of the simulated patients
+        """
+
+        self._compactOutcomes = compact_outcomes
+
+        # update the survival curve with the number of deaths in each cycle
+        death_counts = np.bincount(compact_outcomes.get_survival_cycles())
+        for k in np.nonzero(death_counts)[0]:
+            self._survivalCurve.record((k + 0.5) * compact_outcomes.get_delta_t(), -int(death_counts[k]))
+
+        # summary statistics
+        self._sumStat_survivalTime = Compact.Float64SummaryStat(
+            'Patient survival time', compact_outcomes.get_survival_times())
+        self._sumState_timeToAIDS = Compact.Float64SummaryStat(
+            'Time until AIDS', compact_outcomes.get_times_to_AIDS())
+        self._sumStat_cost = Compact.Float64SummaryStat(
+            'Patient discounted cost', self.get_costs_for_CI())
+        self._sumStat_utility = Compact.Float64SummaryStat(
+            'Patient discounted utility', self.get_utilities_for_CI())
 
     def get_survival_times(self):
+        if self._compactOutcomes is not None:
+            return self._compactOutcomes.get_survival_times()
         return self._survivalTimes
 
     def get_times_to_AIDS(self):
+        if self._compactOutcomes is not None:
+            return self._compactOutcomes.get_times_to_AIDS()
         return self._times_to_AIDS
 
     def get_costs(self):
+        if self._compactOutcomes is not None:
+            return self._compactOutcomes.get_costs()
         return self._costs
 
     def get_utilities(self):
+        if self._compactOutcomes is not None:
+            return self._compactOutcomes.get_utilities()
         return self._utilities
 
+    def get_costs_for_CI(self):
+        """ :returns independent observations of the discounted cost
+        (with antithetic variates, the average cost of each pair of patients) """
+        if Data.ANTITHETIC_VARIATES:
+            return get_pair_averages(self.get_costs())
+        return self.get_costs()
+
+    def get_utilities_for_CI(self):
+        """ :returns independent observations of the discounted utility
+        (with antithetic variates, the average utility of each pair of patients) """
+        if Data.ANTITHETIC_VARIATES:
+            return get_pair_averages(self.get_utilities())
+        return self.get_utilities()
+
     def get_sumStat_survival_times(self):
         return self._sumStat_survivalTime
 
@@ -288,3 +563,30 @@ class CohortOutputs:
 
     def get_survival_curve(self):
         return self._survivalCurve
+
+
+def get_pair_averages(values):
+    """ :returns (float64 array) averages of the values of patients 2j and 2j+1 (antithetic pairs);
+    the value of the last patient of an odd population is dropped """
+    values = np.asarray(values, dtype=float)
+    return values[:len(values) // 2 * 2].reshape(-1, 2).mean(axis=1)
+
+
+def get_cohort_trace(parameters):
+    """ calculates the expected distribution of a cohort over health states in each simulation cycle
+    :param parameters: parameter object
+    :returns (cycles+1 x states) array whose row k is the probability of being in each state at time step k
+    """
+
+    # per-cycle transition probability matrices
+    prob_matrices = parameters.get_prob_matrix_stack().get_array()
+
+    # the cohort starts in the initial health state
+    trace = np.zeros((prob_matrices.shape[0] + 1, len(P.HealthStats)))
+    trace[0, parameters.get_initial_health_state().value] = 1
+
+    # propagate the state distribution through the matrix of each cycle
+    for k in range(prob_matrices.shape[0]):
+        trace[k + 1] = trace[k] @ prob_matrices[k]
+
+    return trace
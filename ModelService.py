@@ -0,0 +1,299 @@
+""" a long-running local service that keeps the model loaded and answers scenario requests
+
+Start the service on a Unix socket or on a localhost TCP port:
+    python ModelService.py --socket /tmp/hiv_model.sock
+    python ModelService.py --port 8765
+
+Each request is one line of JSON, for example
+    {"id": 1, "therapies": ["MONO", "COMBO"], "engine": "cohort", "psa": false, "overrides": {"POP_SIZE": 500}}
+where
+    therapies: names of the therapies to simulate (the first one is the reference therapy)
+    engine: 'cohort' (Data.POP_SIZE patients per therapy), 'adaptive' (simulate until the target precision)
+            or 'analytic' (expected outcomes from the fundamental matrix, for Data.POP_SIZE draws under PSA)
+    psa: if probabilistic sensitivity analysis is on (Data.PSA_ON if not specified)
+    overrides: values replacing the ones in InputData for this request only
+The service answers with one line of JSON for each therapy as soon as it is simulated, one line comparing
+every therapy to the reference therapy, and a final line {"id": ..., "done": true}.
+A request that fails is answered with {"id": ..., "error": "..."}.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import scr.StatisticalClasses as Stat
+import InputData as Data
+import ParameterClasses as P
+import MarkovModelClasses as MarkovCls
+import AdaptiveCohortClasses as AdaptiveCls
+import AnalyticSolverClasses as Analytic
+import SupportMarkovModel as SupportMarkov
+
+ENGINES = ['cohort', 'adaptive', 'analytic']
+CACHE_SIZE = 128    # default number of answered requests kept in the cache
+
+
+def _init_worker():
+    """ prepares a worker process by calculating the transition matrices of every therapy """
+    for therapy in P.Therapies:
+        P.ParametersFixed(therapy)
+
+
+def _summarize_stat(stat):
+    """ :returns (dictionary) mean and confidence interval of a summary statistics """
+    return {'mean': float(stat.get_mean()),
+            'ci': [float(v) for v in stat.get_t_CI(alpha=Data.ALPHA)]}
+
+
+def _summarize_outputs(therapy_name, sim_outputs):
+    """ :returns (dictionary) summary of the outputs of a simulated cohort, with the patient outcomes
+    needed to compare therapies """
+    return {
+        'therapy': therapy_name,
+        'n_patients': len(sim_outputs.get_costs()),
+        'survival_time': _summarize_stat(sim_outputs.get_sumStat_survival_times()),
+        'time_to_AIDS': _summarize_stat(sim_outputs.get_sumStat_time_to_AIDS()),
+        'cost': _summarize_stat(sim_outputs.get_sumStat_discounted_cost()),
+        'utility': _summarize_stat(sim_outputs.get_sumStat_discounted_utility()),
+        'if_paired': SupportMarkov.get_if_paired(),
+        'costs': [float(v) for v in sim_outputs.get_costs_for_CI()],
+        'utilities': [float(v) for v in sim_outputs.get_utilities_for_CI()],
+    }
+
+
+def _summarize_values(values):
+    """ :returns (dictionary) mean and confidence interval of expected outcomes (one value under fixed parameters
+    or one value per parameter draw under PSA) """
+    values = [float(v) for v in values if not math.isnan(v)]
+    if len(values) == 0:
+        return {'mean': None, 'ci': [None, None]}
+    if len(values) == 1:
+        return {'mean': values[0], 'ci': [values[0], values[0]]}
+    return _summarize_stat(Stat.SummaryStat('Expected outcome', values))
+
+
+def _summarize_expected_outcomes(therapy_name, expected_outcomes):
+    """ :returns (dictionary) summary of expected outcomes in the same form as the summary of a simulated cohort """
+    return {
+        'therapy': therapy_name,
+        'n_patients': 0,
+        'n_parameter_sets': len(expected_outcomes.get_costs()),
+        'survival_time': _summarize_values(expected_outcomes.get_survival_times()),
+        'time_to_AIDS': _summarize_values(expected_outcomes.get_times_to_AIDS()),
+        'cost': _summarize_values(expected_outcomes.get_costs()),
+        'utility': _summarize_values(expected_outcomes.get_utilities()),
+        'if_paired': True,   # parameter draw i is the same for every therapy
+        'costs': [float(v) for v in expected_outcomes.get_costs()],
+        'utilities': [float(v) for v in expected_outcomes.get_utilities()],
+    }
+
+
+def _public_summary(summary):
+    """ :returns summary of a cohort without the patient outcomes """
+    return {'result': {k: v for k, v in summary.items() if k not in ['costs', 'utilities']}}
+
+
+def simulate_cohort(cohort_id, therapy_name, overrides):
+    """ simulates one cohort (runs in a worker process)
+    :returns (dictionary) summary of the cohort outputs
+    """
+    with P.override_inputs(overrides):
+        cohort = MarkovCls.Cohort(id=cohort_id, therapy=P.Therapies[therapy_name])
+        return _summarize_outputs(therapy_name, cohort.simulate())
+
+
+def simulate_adaptive(therapy_names, overrides):
+    """ simulates all therapies until the target precision is reached (runs in a worker process)
+    :returns (list of dictionaries) summary of the outputs of each cohort
+    """
+    with P.override_inputs(overrides):
+        comparison = AdaptiveCls.AdaptiveComparison(therapies=[P.Therapies[name] for name in therapy_names])
+        sim_outputs = comparison.simulate()
+        summaries = [_summarize_outputs(name, outputs) for name, outputs in zip(therapy_names, sim_outputs)]
+        for summary in summaries:
+            summary['if_converged'] = comparison.get_if_converged()
+        return summaries
+
+
+def solve_analytic(therapy_names, overrides):
+    """ calculates the expected outcomes of all therapies (runs in a worker process)
+    :returns (list of dictionaries) summary of the expected outcomes of each therapy
+    """
+    with P.override_inputs(overrides):
+        summaries = []
+        for name in therapy_names:
+            if Data.PSA_ON:
+                expected_outcomes = Analytic.get_expected_outcomes_PSA(P.Therapies[name])
+            else:
+                expected_outcomes = Analytic.get_expected_outcomes(P.Therapies[name])
+            summaries.append(_summarize_expected_outcomes(name, expected_outcomes))
+        return summaries
+
+
+def compare_to_reference(ref_summary, summary):
+    """ :returns (dictionary) increase in discounted cost and utility with respect to the reference therapy """
+
+    result = {'therapy': summary['therapy'], 'reference': ref_summary['therapy']}
+    for key, obs_key in [('cost', 'costs'), ('utility', 'utilities')]:
+        if len(summary[obs_key]) == 1:
+            # expected outcomes under fixed parameters
+            increase = summary[obs_key][0] - ref_summary[obs_key][0]
+            result['increase_' + key] = {'mean': increase, 'ci': [increase, increase]}
+            continue
+        if summary['if_paired']:
+            stat = Stat.DifferenceStatPaired(
+                name='Increase in ' + key, x=summary[obs_key], y_ref=ref_summary[obs_key])
+        else:
+            stat = Stat.DifferenceStatIndp(
+                name='Increase in ' + key, x=summary[obs_key], y_ref=ref_summary[obs_key])
+        result['increase_' + key] = _summarize_stat(stat)
+
+    # incremental cost-effectiveness ratio
+    if result['increase_utility']['mean'] != 0:
+        result['ICER'] = result['increase_cost']['mean'] / result['increase_utility']['mean']
+    else:
+        result['ICER'] = None
+
+    return result
+
+
+class ModelService:
+    """ answers scenario requests by dispatching simulations to a pool of warm worker processes """
+    def __init__(self, n_workers=None, cache_size=CACHE_SIZE):
+        """
+        :param n_workers: number of worker processes (number of CPUs if not specified)
+        :param cache_size: maximum number of answered requests kept in the cache
+                           (the least recently used one is removed first)
+        """
+        self._executor = ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker)
+        self._cacheSize = cache_size
+        self._resultCache = OrderedDict()  # lines answered to previous requests keyed by the request (without its id)
+
+    async def handle_connection(self, reader, writer):
+        """ reads requests (one JSON per line) from a client and answers each one as soon as possible """
+
+        write_lock = asyncio.Lock()     # lines of concurrent answers should not interleave
+        tasks = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if line.strip():
+                tasks.append(asyncio.ensure_future(self._answer(line, writer, write_lock)))
+
+        await asyncio.gather(*tasks)
+        writer.close()
+
+    async def _answer(self, line, writer, write_lock):
+        """ answers one request line """
+
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get('id')
+            async for result in self.run_request(request):
+                await self._write(writer, write_lock, dict(result, id=request_id))
+        except Exception as e:
+            await self._write(writer, write_lock, {'id': request_id, 'error': '{}: {}'.format(type(e).__name__, e)})
+
+    @staticmethod
+    async def _write(writer, write_lock, result):
+        async with write_lock:
+            writer.write((json.dumps(result) + '\n').encode())
+            await writer.drain()
+
+    async def run_request(self, request):
+        """ simulates a scenario request
+        :param request: (dictionary) request as described in the module docstring
+        :returns (async generator) result lines of the request
+        """
+
+        therapy_names = request.get('therapies', [t.name for t in P.Therapies])
+        engine = request.get('engine', 'cohort')
+        overrides = dict(request.get('overrides', {}))
+        if 'psa' in request:
+            overrides['PSA_ON'] = bool(request['psa'])
+
+        # check the request before dispatching it
+        for name in therapy_names:
+            if name not in P.Therapies.__members__:
+                raise ValueError("Unknown therapy '{}'.".format(name))
+        if engine not in ENGINES:
+            raise ValueError("Unknown engine '{}'.".format(engine))
+        P.check_input_names(overrides)
+
+        # answer from the cache if this scenario was already simulated
+        key = json.dumps({'therapies': therapy_names, 'engine': engine, 'overrides': overrides}, sort_keys=True)
+        if key in self._resultCache:
+            self._resultCache.move_to_end(key)
+            for result in self._resultCache[key]:
+                yield result
+            yield {'done': True, 'cached': True}
+            return
+
+        loop = asyncio.get_running_loop()
+        results = []
+        summaries = {}
+
+        if engine in ['adaptive', 'analytic']:
+            function = simulate_adaptive if engine == 'adaptive' else solve_analytic
+            for summary in await loop.run_in_executor(self._executor, function, therapy_names, overrides):
+                summaries[summary['therapy']] = summary
+                results.append(_public_summary(summary))
+                yield results[-1]
+        else:
+            # simulate every therapy in parallel and answer as soon as each one is done
+            futures = [loop.run_in_executor(self._executor, simulate_cohort, i, name, overrides)
+                       for i, name in enumerate(therapy_names)]
+            for future in asyncio.as_completed(futures):
+                summary = await future
+                summaries[summary['therapy']] = summary
+                results.append(_public_summary(summary))
+                yield results[-1]
+
+        # compare every therapy to the reference therapy
+        for name in therapy_names[1:]:
+            results.append({'comparison': compare_to_reference(summaries[therapy_names[0]], summaries[name])})
+            yield results[-1]
+
+        self._resultCache[key] = results
+        if len(self._resultCache) > self._cacheSize:
+            self._resultCache.popitem(last=False)
+        yield {'done': True, 'cached': False}
+
+    def shutdown(self):
+        self._executor.shutdown()
+
+
+async def serve(service, socket_path=None, port=None):
+    """ serves requests on a Unix socket (if socket_path is specified) or on a localhost TCP port """
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = await asyncio.start_unix_server(service.handle_connection, path=socket_path)
+    else:
+        server = await asyncio.start_server(service.handle_connection, host='127.0.0.1', port=port)
+
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Local service answering scenario requests for the HIV model.')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--socket', help='path of the Unix socket to listen on')
+    group.add_argument('--port', type=int, help='localhost TCP port to listen on')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE, help='number of answered requests to cache')
+    args = parser.parse_args()
+
+    model_service = ModelService(n_workers=args.workers, cache_size=args.cache_size)
+    try:
+        asyncio.run(serve(model_service, socket_path=args.socket, port=args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        model_service.shutdown()
@@ -1,4 +1,6 @@
+from contextlib import contextmanager
 from enum import Enum
+from types import ModuleType
 import numpy as np
 import scipy.stats as stat
 import math as math
@@ -23,6 +25,45 @@ class Therapies(Enum):
     COMBO = 1
 
 
+class ProbMatrixStack:
+    """ transition probability matrices of each simulation cycle
+    (cycles with the same background mortality share one matrix, which should be treated as read-only) """
+    def __init__(self, prob_matrices, matrix_index):
+        """
+        :param prob_matrices: (list of lists of lists) distinct transition probability matrices
+        :param matrix_index: (list) index of the matrix used in each simulation cycle
+        """
+        self._probMatrices = prob_matrices
+        self._matrixIndex = matrix_index
+        self._array = None              # (cycles x states x states) array (built when needed)
+
+    def get_n_cycles(self):
+        return len(self._matrixIndex)
+
+    def get_if_time_dependent(self):
+        """ :returns True if the transition probabilities change over simulation cycles """
+        return len(self._probMatrices) > 1
+
+    def get_distinct_prob_matrices(self):
+        """ :returns list of the distinct transition probability matrices """
+        return self._probMatrices
+
+    def get_matrix_index(self):
+        """ :returns list of the index (in the distinct matrices) of the matrix of each simulation cycle """
+        return self._matrixIndex
+
+    def get_prob_matrix(self, k):
+        """ :returns transition probability matrix of simulation cycle k """
+        return self._probMatrices[self._matrixIndex[min(k, len(self._matrixIndex) - 1)]]
+
+    def get_array(self):
+        """ :returns read-only (cycles x states x states) array of the transition probability matrix of each cycle """
+        if self._array is None:
+            self._array = np.array(self._probMatrices, dtype=float)[self._matrixIndex]
+            self._array.flags.writeable = False
+        return self._array
+
+
 class _Parameters:
 
     def __init__(self, therapy):
@@ -45,8 +86,8 @@ class _Parameters:
         else:
             self._annualTreatmentCost = Data.Zidovudine_COST + Data.Lamivudine_COST
 
-        # transition probability matrix of the selected therapy
-        self._prob_matrix = []
+        # per-cycle transition probability matrices of the selected therapy
+        self._probMatrixStack = None
 
         # treatment relative risk
         self._treatmentRR = 0
@@ -64,8 +105,12 @@ class _Parameters:
     def get_adj_discount_rate(self):
         return self._adjDiscountRate
 
-    def get_transition_prob(self, state):
-        return self._prob_matrix[state.value]
+    def get_transition_prob(self, state, k=0):
+        """ :returns transition probabilities out of the specified state in simulation cycle k """
+        return self._probMatrixStack.get_prob_matrix(k)[state.value]
+
+    def get_prob_matrix_stack(self):
+        return self._probMatrixStack
 
     def get_annual_state_cost(self, state):
         if state == HealthStats.HIV_DEATH or state == HealthStats.BACKGROUND_DEATH:
@@ -89,19 +134,17 @@ class ParametersFixed(_Parameters):
         # initialize the base class
         _Parameters.__init__(self, therapy)
 
-        # calculate transition probabilities between hiv states
-        self._prob_matrix = calculate_prob_matrix_mono()
-        # add background mortality if needed
-        if Data.ADD_BACKGROUND_MORT:
-            add_background_mortality(self._prob_matrix)
-
-        # update the transition probability matrix if combination therapy is being used
+        # treatment relative risk
         if self._therapy == Therapies.COMBO:
-            # treatment relative risk
             self._treatmentRR = Data.TREATMENT_RR
-            # calculate transition probability matrix for the combination therapy
-            self._prob_matrix = calculate_prob_matrix_combo(
-                matrix_mono=self._prob_matrix, combo_rr=Data.TREATMENT_RR)
+
+        # per-cycle transition probability matrices
+        # (calculated once for each therapy and set of inputs, and shared by all patients)
+        key = (self._therapy, get_prob_matrix_inputs())
+        if key not in _fixedProbMatrixStacks:
+            _fixedProbMatrixStacks[key] = build_prob_matrix_stack(
+                hiv_prob_matrix=calculate_prob_matrix_mono(), therapy=self._therapy, combo_rr=Data.TREATMENT_RR)
+        self._probMatrixStack = _fixedProbMatrixStacks[key]
 
         # annual state costs and utilities
         self._annualStateCosts = Data.ANNUAL_STATE_COST
@@ -156,33 +199,29 @@ class ParametersProbabilistic(_Parameters):
 
         # calculate transition probabilities
         # create an empty matrix populated with zeroes
-        self._prob_matrix = []
+        hiv_prob_matrix = []
         for s in HealthStats:
-            self._prob_matrix.append([0] * len(HealthStats))
+            hiv_prob_matrix.append([0] * len(HealthStats))
 
         # for all health states
         for s in HealthStats:
             # if the current state is death
             if s in [HealthStats.HIV_DEATH, HealthStats.BACKGROUND_DEATH]:
                 # the probability of staying in this state is 1
-                self._prob_matrix[s.value][s.value] = 1
+                hiv_prob_matrix[s.value][s.value] = 1
             else:
                 # sample from the dirichlet distribution to find the transition probabilities between hiv states
                 sample = self._hivProbMatrixRVG[s.value].sample(self._rng)
                 for j in range(len(sample)):
-                    self._prob_matrix[s.value][s.value+j] = sample[j]
-
-        # add background mortality if needed
-        if Data.ADD_BACKGROUND_MORT:
-            add_background_mortality(self._prob_matrix)
+                    hiv_prob_matrix[s.value][s.value+j] = sample[j]
 
-        # update the transition probability matrix if combination therapy is being used
+        # sample the treatment relative risk if combination therapy is being used
         if self._therapy == Therapies.COMBO:
-            # treatment relative risk
             self._treatmentRR = math.exp(self._lnRelativeRiskRVG.sample(self._rng))
-            # calculate transition probability matrix for the combination therapy
-            self._prob_matrix = calculate_prob_matrix_combo(
-                matrix_mono=self._prob_matrix, combo_rr=self._treatmentRR)
+
+        # per-cycle transition probability matrices
+        self._probMatrixStack = build_prob_matrix_stack(
+            hiv_prob_matrix=hiv_prob_matrix, therapy=self._therapy, combo_rr=self._treatmentRR)
 
         # sample from gamma distributions that are assumed for annual state costs
         self._annualStateCosts = []
@@ -195,6 +234,118 @@ class ParametersProbabilistic(_Parameters):
             self._annualStateUtilities.append(dist.sample(self._rng))
 
 
+# per-cycle transition probability matrices under fixed parameters keyed by therapy and the inputs they are
+# calculated from (shared read-only by all patients and by worker processes forked after they are calculated)
+_fixedProbMatrixStacks = {}
+
+
+def get_prob_matrix_inputs():
+    """ :returns (string) current values of the inputs that the transition probability matrices
+    under fixed parameters are calculated from """
+    return repr((Data.TRANS_MATRIX, Data.TREATMENT_RR, Data.DELTA_T, Data.SIM_LENGTH,
+                 Data.ADD_BACKGROUND_MORT, Data.ANNUAL_PROB_BACKGROUND_MORT,
+                 Data.AGE_DEPENDENT_BACKGROUND_MORT, Data.INITIAL_AGE, Data.LIFE_TABLE))
+
+
+def clear_prob_matrix_cache():
+    """ removes the transition probability matrices calculated for fixed parameters (to free memory) """
+    _fixedProbMatrixStacks.clear()
+
+
+def get_input_names():
+    """ :returns names of all inputs in InputData (public attributes that are not modules or functions) """
+    return [name for name, value in vars(Data).items()
+            if not name.startswith('_') and not callable(value) and not isinstance(value, ModuleType)]
+
+
+def check_input_names(names):
+    """ raises an error if any of the names is not an input in InputData
+    :param names: names of inputs (e.g. the keys of a dictionary of new values)
+    """
+    input_names = get_input_names()
+    for name in names:
+        if name not in input_names:
+            raise ValueError("Unknown input '{}'.".format(name))
+
+
+@contextmanager
+def override_inputs(overrides):
+    """ temporarily replaces values of InputData (e.g. with override_inputs({'POP_SIZE': 500}): ...)
+    :param overrides: (dictionary) new values keyed by the name of the input
+    """
+
+    # check the names before changing anything
+    check_input_names(overrides)
+
+    # replace the inputs
+    originals = {name: getattr(Data, name) for name in overrides}
+    for name, value in overrides.items():
+        setattr(Data, name, value)
+
+    try:
+        yield
+    finally:
+        # restore the original inputs
+        for name, value in originals.items():
+            setattr(Data, name, value)
+
+
+def get_annual_prob_background_mort(age):
+    """ :returns annual probability of background mortality at the specified age (from Data.LIFE_TABLE) """
+    prob = Data.LIFE_TABLE[0][1]
+    for band_age, band_prob in Data.LIFE_TABLE:
+        if age >= band_age:
+            prob = band_prob
+        else:
+            break
+    return prob
+
+
+def build_prob_matrix_stack(hiv_prob_matrix, therapy, combo_rr):
+    """
+    :param hiv_prob_matrix: (list of lists) annual transition probability matrix between hiv states
+    :param therapy: selected therapy
+    :param combo_rr: relative risk of the combination treatment
+    :returns (ProbMatrixStack) transition probability matrices of each simulation cycle
+    """
+
+    prob_matrices = []      # distinct transition probability matrices
+    matrix_index = []       # index of the matrix used in each simulation cycle
+    index_of_prob = {}      # index of the matrix calculated for each annual probability of background mortality
+
+    # transition rate matrix between hiv states (calculated once for all background mortality probabilities)
+    if Data.ADD_BACKGROUND_MORT:
+        hiv_rate_matrix = MarkovCls.discrete_to_continuous(hiv_prob_matrix, 1)
+
+    for k in range(int(math.ceil(Data.SIM_LENGTH / Data.DELTA_T))):
+
+        # annual probability of background mortality in this cycle
+        if not Data.ADD_BACKGROUND_MORT:
+            annual_prob = None
+        elif Data.AGE_DEPENDENT_BACKGROUND_MORT:
+            annual_prob = get_annual_prob_background_mort(Data.INITIAL_AGE + k * Data.DELTA_T)
+        else:
+            annual_prob = Data.ANNUAL_PROB_BACKGROUND_MORT
+
+        # calculate the transition probability matrix if not already calculated for this background mortality
+        if annual_prob not in index_of_prob:
+            # add background mortality if needed
+            if annual_prob is None:
+                prob_matrix = hiv_prob_matrix
+            else:
+                prob_matrix = calculate_prob_matrix_with_background_mort(hiv_rate_matrix, annual_prob)
+            # update the transition probability matrix if combination therapy is being used
+            if therapy == Therapies.COMBO:
+                prob_matrix = calculate_prob_matrix_combo(matrix_mono=prob_matrix, combo_rr=combo_rr)
+
+            index_of_prob[annual_prob] = len(prob_matrices)
+            prob_matrices.append(prob_matrix)
+
+        matrix_index.append(index_of_prob[annual_prob])
+
+    return ProbMatrixStack(prob_matrices, matrix_index)
+
+
 def calculate_prob_matrix_mono():
     """ :returns transition probability matrix for hiv states under mono therapy"""
 
@@ -219,20 +370,29 @@ def calculate_prob_matrix_mono():
     return prob_matrix
 
 
-def add_background_mortality(prob_matrix):
+def calculate_prob_matrix_with_background_mort(rate_matrix, annual_prob=None):
+    """
+    :param rate_matrix: (list of lists) transition rate matrix between hiv states (not modified)
+    :param annual_prob: annual probability of background mortality (Data.ANNUAL_PROB_BACKGROUND_MORT if not specified)
+    :returns (list of lists) transition probability matrix over DELTA_T with background mortality
+    """
+
+    if annual_prob is None:
+        annual_prob = Data.ANNUAL_PROB_BACKGROUND_MORT
 
-    # find the transition rate matrix
-    rate_matrix = MarkovCls.discrete_to_continuous(prob_matrix, 1)
     # add mortality rates
+    rate_matrix = [list(row) for row in rate_matrix]
     for s in HealthStats:
         if s not in [HealthStats.HIV_DEATH, HealthStats.BACKGROUND_DEATH]:
             rate_matrix[s.value][HealthStats.BACKGROUND_DEATH.value] \
-                = -np.log(1 - Data.ANNUAL_PROB_BACKGROUND_MORT)
+                = -np.log(1 - annual_prob)
 
     # convert back to transition probability matrix
-    prob_matrix[:], p = MarkovCls.continuous_to_discrete(rate_matrix, Data.DELTA_T)
+    prob_matrix, p = MarkovCls.continuous_to_discrete(rate_matrix, Data.DELTA_T)
     # print('Upper bound on the probability of two transitions within delta_t:', p)
 
+    return prob_matrix
+
 
 def calculate_prob_matrix_combo(matrix_mono, combo_rr):
     """
@@ -255,5 +415,8 @@ def calculate_prob_matrix_combo(matrix_mono, combo_rr):
     for s in HealthStats:
         if s not in [HealthStats.HIV_DEATH, HealthStats.BACKGROUND_DEATH]:
             matrix_combo[s.value][s.value] = 1 - sum(matrix_combo[s.value][s.value + 1:])
+        else:
+            # death states are absorbing
+            matrix_combo[s.value][s.value] = 1
 
     return matrix_combo
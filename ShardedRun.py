@@ -0,0 +1,151 @@
+""" splits the simulation of one cohort across several processes or nodes sharing a file system
+
+    python ShardedRun.py plan --dir runs/combo --therapy COMBO --cohort-id 1 --shards 8
+    python ShardedRun.py run-shard --dir runs/combo --shard 0      (one per shard, on any node)
+    python ShardedRun.py merge --dir runs/combo
+
+The merged outputs are identical to simulating the cohort on a single node, since every patient
+seeds its random number generators from its index in the cohort.
+"""
+import argparse
+import json
+import os
+import InputData as Data
+import ParameterClasses as P
+import MarkovModelClasses as MarkovCls
+import SupportCheckpoint as Checkpoint
+import SupportMarkovModel as SupportMarkov
+
+MANIFEST_FILE = 'manifest.json'
+MERGED_FILE = 'merged.npz'
+
+
+def _create_cohort(manifest):
+    """ :returns the (not yet simulated) cohort described by a manifest """
+    return MarkovCls.Cohort(
+        id=manifest['cohort_id'], therapy=P.Therapies[manifest['therapy']], pop_size=manifest['pop_size'])
+
+
+def _check_inputs(manifest, cohort):
+    """ raises an error if the inputs of this node are different from the inputs the run was planned with """
+    if cohort.get_input_hash() != manifest['input_hash']:
+        raise ValueError('Inputs of this node are different from the inputs of the planned run.')
+
+
+def load_manifest(directory):
+    """ :returns (dictionary) the manifest of the run in the specified directory """
+    with open(os.path.join(directory, MANIFEST_FILE)) as file:
+        return json.load(file)
+
+
+def plan(directory, therapy, cohort_id, n_shards, pop_size=None):
+    """ writes the manifest of a sharded run
+    :param directory: directory (on the shared file system) of the run
+    :param therapy: selected therapy
+    :param cohort_id: id of the cohort
+    :param n_shards: number of shards to split the patients into
+    :param pop_size: number of patients (Data.POP_SIZE if not specified)
+    :returns (dictionary) the manifest
+    """
+
+    cohort = MarkovCls.Cohort(id=cohort_id, therapy=therapy, pop_size=pop_size)
+    pop_size = cohort.get_initial_pop_size()
+
+    # split patients into shards of (almost) equal size
+    shards = []
+    for k in range(n_shards):
+        first = k * pop_size // n_shards
+        end = (k + 1) * pop_size // n_shards
+        shards.append({
+            'index': k,
+            'first_patient': first,
+            'end_patient': end,
+            # patient i uses parameter seed get_parameter_seed(i) (under PSA) and transition seed get_patient_seed(i)
+            'first_seed': cohort.get_patient_seed(first) if end > first else None,
+            'result_file': 'shard_{:04d}.npz'.format(k)})
+
+    manifest = {
+        'cohort_id': cohort_id,
+        'therapy': therapy.name,
+        'pop_size': pop_size,
+        'input_hash': cohort.get_input_hash(),
+        'shards': shards}
+
+    # write the manifest
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = Checkpoint.get_tmp_path(os.path.join(directory, MANIFEST_FILE))
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(tmp_path, os.path.join(directory, MANIFEST_FILE))
+
+    return manifest
+
+
+def run_shard(directory, shard_index):
+    """ simulates the patients of one shard and saves their outcomes to the result file of the shard
+    (a shard whose result file already exists is not simulated again) """
+
+    manifest = load_manifest(directory)
+    shard = manifest['shards'][shard_index]
+    result_path = os.path.join(directory, shard['result_file'])
+    if os.path.exists(result_path):
+        return
+
+    cohort = _create_cohort(manifest)
+    _check_inputs(manifest, cohort)
+
+    # simulate the patients of this shard (keeping only the outcomes of each patient)
+    outcomes = [MarkovCls.PatientOutcomes(p.get_survival_time(), p.get_time_to_AIDS(),
+                                          p.get_total_discounted_cost(), p.get_total_discounted_utility())
+                for p in cohort.simulate_range(shard['first_patient'], shard['end_patient'])]
+    Checkpoint.save_outcomes(result_path, outcomes, manifest['input_hash'], first_patient=shard['first_patient'])
+
+
+def merge(directory):
+    """ combines the results of all shards
+    :returns outputs of the simulated cohort (identical to simulating the cohort on a single node)
+    """
+
+    manifest = load_manifest(directory)
+    cohort = _create_cohort(manifest)
+
+    # add the outcomes of each shard in the order of patients
+    for shard in manifest['shards']:
+        result_path = os.path.join(directory, shard['result_file'])
+        if not os.path.exists(result_path):
+            raise ValueError("Shard {} has not been simulated yet.".format(shard['index']))
+        cohort.add_patient_outcomes(Checkpoint.load_outcomes(result_path, manifest['input_hash']))
+
+    # save the outcomes of all patients
+    Checkpoint.save_outcomes(os.path.join(directory, MERGED_FILE), cohort.get_patients(), manifest['input_hash'])
+
+    return MarkovCls.CohortOutputs(cohort)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Sharded simulation of a cohort over a shared file system.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    plan_parser = subparsers.add_parser('plan', help='write the manifest of a sharded run')
+    plan_parser.add_argument('--dir', required=True, help='directory of the run')
+    plan_parser.add_argument('--therapy', required=True, choices=[t.name for t in P.Therapies])
+    plan_parser.add_argument('--cohort-id', type=int, required=True, help='id of the cohort')
+    plan_parser.add_argument('--shards', type=int, required=True, help='number of shards')
+    plan_parser.add_argument('--pop-size', type=int, default=Data.POP_SIZE, help='number of patients')
+
+    run_parser = subparsers.add_parser('run-shard', help='simulate one shard')
+    run_parser.add_argument('--dir', required=True, help='directory of the run')
+    run_parser.add_argument('--shard', type=int, required=True, help='index of the shard')
+
+    merge_parser = subparsers.add_parser('merge', help='combine the results of all shards')
+    merge_parser.add_argument('--dir', required=True, help='directory of the run')
+
+    args = parser.parse_args()
+
+    if args.command == 'plan':
+        plan(args.dir, P.Therapies[args.therapy], args.cohort_id, args.shards, args.pop_size)
+    elif args.command == 'run-shard':
+        run_shard(args.dir, args.shard)
+    else:
+        SupportMarkov.print_outcomes(merge(args.dir), load_manifest(args.dir)['therapy'] + ':')
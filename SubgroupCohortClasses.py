@@ -0,0 +1,331 @@
+import numpy as np
+import scr.RandomVariantGenerators as rndClasses
+import InputData as Data
+import ParameterClasses as P
+import MarkovModelClasses as MarkovCls
+import SupportCheckpoint as Checkpoint
+
+# inputs that can be different for a subgroup: only the inputs that parameter objects are created from
+# (inputs such as SIM_LENGTH and DELTA_T apply to the whole cohort)
+SUBGROUP_INPUTS = ['TRANS_MATRIX', 'TREATMENT_RR', 'TREATMENT_RR_CI', 'ANNUAL_STATE_COST', 'ANNUAL_STATE_UTILITY',
+                   'Zidovudine_COST', 'Lamivudine_COST', 'DISCOUNT', 'ADD_BACKGROUND_MORT',
+                   'AGE_DEPENDENT_BACKGROUND_MORT', 'INITIAL_AGE', 'LIFE_TABLE', 'ANNUAL_PROB_BACKGROUND_MORT']
+
+# number of patients simulated together (limits the memory used by the parameters of a block under PSA)
+BLOCK_SIZE = 2000
+
+# death states
+DEATH_STATES = [P.HealthStats.HIV_DEATH.value, P.HealthStats.BACKGROUND_DEATH.value]
+
+
+def allocate(n, weights, if_pairs=False):
+    """ allocates n items proportional to the weights (largest remainder method)
+    :param if_pairs: if items should be allocated in pairs (every count is even, except the last positive
+                     count if n is odd, so consecutive items 2j and 2j+1 are always allocated together)
+    :returns (list) number of items allocated to each weight
+    """
+
+    total = sum(weights)
+    if total <= 0:
+        raise ValueError('Weights should add up to a positive number.')
+
+    if if_pairs:
+        counts = [2 * c for c in allocate(n // 2, weights)]
+        if n % 2 == 1:
+            counts[max(i for i, w in enumerate(weights) if w > 0)] += 1
+        return counts
+
+    shares = [n * w / total for w in weights]
+    counts = [int(s) for s in shares]
+
+    # give the remaining items to the largest remainders
+    by_remainder = sorted(range(len(weights)), key=lambda i: shares[i] - counts[i], reverse=True)
+    for i in by_remainder[:n - sum(counts)]:
+        counts[i] += 1
+
+    return counts
+
+
+class _PatientGroup:
+    """ simulated patients of one subgroup (to extract the cohort outputs of the subgroup) """
+    def __init__(self, patients):
+        self._patients = patients
+
+    def get_patients(self):
+        return self._patients
+
+
+class StackedParameters:
+    """ parameters of several parameter objects stacked into arrays, so that patients with different parameters
+    can be simulated together: the distinct transition probability matrices of all parameter objects are stacked
+    into one (matrices x states x states) array and row j of the (parameter objects x cycles) matrix index gives
+    the matrix of each cycle for parameter object j """
+    def __init__(self, parameters_list):
+        """
+        :param parameters_list: list of parameter objects
+        """
+
+        prob_matrices = []
+        self._matrixIndex = []
+        for param in parameters_list:
+            stack = param.get_prob_matrix_stack()
+            offset = len(prob_matrices)
+            prob_matrices.extend(stack.get_distinct_prob_matrices())
+            self._matrixIndex.append([offset + j for j in stack.get_matrix_index()])
+
+        self._probMatrices = np.array(prob_matrices, dtype=float)
+        self._matrixIndex = np.array(self._matrixIndex, dtype=np.intp)
+        if np.tril(self._probMatrices, -1).any():
+            raise ValueError('Health states should only progress to be simulated in blocks.')
+
+        states = list(P.HealthStats)
+        self._stateCosts = np.array([[param.get_annual_state_cost(s) for s in states]
+                                     for param in parameters_list], dtype=float)
+        self._stateUtilities = np.array([[param.get_annual_state_utility(s) for s in states]
+                                         for param in parameters_list], dtype=float)
+        self._treatmentCosts = np.array([param.get_annual_treatment_cost() for param in parameters_list], dtype=float)
+        self._halfStepFactors = np.array([1 / (1 + param.get_adj_discount_rate() / 2)
+                                          for param in parameters_list], dtype=float)
+        self._delta_t = parameters_list[0].get_delta_t()
+
+    def get_n_cycles(self):
+        return self._matrixIndex.shape[1]
+
+    def get_transition_probs(self, params, states, k):
+        """ :returns (patients x states) transition probabilities out of the current states in cycle k
+        :param params: index of the parameter object of each patient
+        :param states: index of the current state of each patient
+        """
+        return self._probMatrices[self._matrixIndex[params, min(k, self.get_n_cycles() - 1)], states]
+
+    def get_discounted_cost_utility(self, params, states, next_states, k):
+        """ :returns discounted cost and utility of time step k of each patient
+        (same as MarkovModelClasses.PatientCostUtilityMonitor) """
+
+        dt = self._delta_t
+        cost = 0.5 * (self._stateCosts[params, states] + self._stateCosts[params, next_states]) * dt
+        utility = 0.5 * (self._stateUtilities[params, states] + self._stateUtilities[params, next_states]) * dt
+
+        # half of the treatment cost in the time step of death
+        if_death = np.isin(next_states, DEATH_STATES)
+        cost += np.where(if_death, 0.5, 1) * self._treatmentCosts[params] * dt
+
+        # discount over 2k+1 half time steps (corrected for the half-cycle effect)
+        discount = self._halfStepFactors[params] ** (2 * k + 1)
+        return cost * discount, utility * discount
+
+
+class SubgroupCohort(MarkovCls.Cohort):
+    """ a cohort made of subgroups with different initial health states and parameters.
+    Patients are simulated in blocks: all patients of a block (whatever their subgroup) are stepped through time
+    together, using the stacked transition probability matrices of all subgroups (or, under PSA, of all patients
+    of the block). """
+    def __init__(self, id, therapy, subgroups=None, pop_size=None):
+        """ create a cohort of patients from subgroups
+        :param id: an integer to specify the seed of the random number generator
+        :param therapy: selected therapy
+        :param subgroups: (list of dictionaries) subgroup definitions with 'name', 'weight',
+                          'initial_state_dist' and 'overrides' (Data.SUBGROUPS if not specified);
+                          overrides can only change the inputs in SUBGROUP_INPUTS
+        :param pop_size: number of patients to simulate (Data.POP_SIZE if not specified)
+        """
+        MarkovCls.Cohort.__init__(self, id, therapy, pop_size)
+
+        self._subgroups = Data.SUBGROUPS if subgroups is None else subgroups
+        self._patientSubgroups = []         # subgroup of each patient
+        self._patientInitialStates = []     # initial health state of each patient
+        self._subgroupParams = []           # fixed parameters of each subgroup
+        self._stackedParams = None          # stacked fixed parameters of all subgroups
+
+        # allocate patients to subgroups (in proportion to their weights) and,
+        # within each subgroup, to initial health states (in proportion to the initial state distribution);
+        # with antithetic variates, both patients of a pair are allocated to the same subgroup and state
+        if_pairs = Data.ANTITHETIC_VARIATES
+        subgroup_sizes = allocate(self._initial_pop_size, [g['weight'] for g in self._subgroups], if_pairs)
+        for g, subgroup in enumerate(self._subgroups):
+            state_dist = subgroup['initial_state_dist']
+            if abs(sum(state_dist) - 1) > 1e-6:
+                raise ValueError("Initial state distribution of subgroup '{}' should add up to 1.".format(
+                    subgroup['name']))
+            for name in subgroup.get('overrides', {}):
+                if name not in SUBGROUP_INPUTS:
+                    raise ValueError("Input '{}' cannot be different for subgroup '{}'.".format(
+                        name, subgroup['name']))
+
+            for state_index, n in enumerate(allocate(subgroup_sizes[g], state_dist, if_pairs)):
+                self._patientSubgroups.extend([g] * n)
+                self._patientInitialStates.extend([P.HealthStats(state_index)] * n)
+
+        # transition matrices of each subgroup under fixed parameters (calculated once for all its patients)
+        if not Data.PSA_ON:
+            for subgroup in self._subgroups:
+                with P.override_inputs(subgroup.get('overrides', {})):
+                    self._subgroupParams.append(P.ParametersFixed(self._therapy))
+            self._stackedParams = StackedParameters(self._subgroupParams)
+
+    def create_patient(self, i):
+        """ :returns the i-th patient of this cohort (not yet simulated) as a single patient
+        (the cohort itself simulates its patients in blocks) """
+
+        # parameters of this patient
+        g = self._patientSubgroups[i]
+        if Data.PSA_ON:
+            with P.override_inputs(self._subgroups[g].get('overrides', {})):
+                parameters = P.ParametersProbabilistic(self.get_parameter_seed(i), self._therapy)
+        else:
+            parameters = self._subgroupParams[g]
+
+        # create a new patient (use id * pop_size + i as patient id)
+        return MarkovCls.Patient(self._id * self._initial_pop_size + i, parameters,
+                                 seed=self.get_patient_seed(i),
+                                 if_antithetic=Data.ANTITHETIC_VARIATES and i % 2 == 1,
+                                 initial_state=self._patientInitialStates[i],
+                                 trajectories=self._trajectories)
+
+    def simulate_range(self, first, end):
+        """ simulate patients first, ..., end-1 of this cohort (in blocks of BLOCK_SIZE patients)
+        without adding them to the cohort
+        :returns (generator) outcomes of the simulated patients, one at a time
+        """
+        for block_first in range(first, end, BLOCK_SIZE):
+            yield from self._simulate_block(block_first, min(block_first + BLOCK_SIZE, end))
+
+    def _get_block_parameters(self, first, end):
+        """ :returns stacked parameters of patients first, ..., end-1 and the index of the parameters of
+        each patient in the stacked parameters """
+
+        if not Data.PSA_ON:
+            return self._stackedParams, np.array(self._patientSubgroups[first:end], dtype=np.intp)
+
+        # sample the parameters of each patient with the inputs of its subgroup in place
+        # (the inputs are replaced once for each run of patients from the same subgroup,
+        # and both patients of an antithetic pair share the same parameters)
+        parameters_list = []
+        param_indices = []
+        index_of_seed = {}
+        i = first
+        while i < end:
+            g = self._patientSubgroups[i]
+            run_end = i
+            while run_end < end and self._patientSubgroups[run_end] == g:
+                run_end += 1
+            with P.override_inputs(self._subgroups[g].get('overrides', {})):
+                for j in range(i, run_end):
+                    seed = self.get_parameter_seed(j)
+                    if seed not in index_of_seed:
+                        index_of_seed[seed] = len(parameters_list)
+                        parameters_list.append(P.ParametersProbabilistic(seed, self._therapy))
+                    param_indices.append(index_of_seed[seed])
+            i = run_end
+
+        return StackedParameters(parameters_list), np.array(param_indices, dtype=np.intp)
+
+    def _simulate_block(self, first, end):
+        """ simulates patients first, ..., end-1 together
+        :returns (generator) outcomes of the simulated patients, one at a time
+        """
+
+        stacked_params, params = self._get_block_parameters(first, end)
+        n = end - first
+        n_states = len(P.HealthStats)
+        rows = np.arange(n)
+
+        # uniform random numbers of each patient: as for a single patient with common random numbers or antithetic
+        # variates, one number for the time step at which the patient leaves each visited state and one for the
+        # state it moves to. Health states only progress, so a patient visits each state at most once.
+        # Numbers are drawn from the patient's own random number generator so outcomes do not depend on blocks.
+        uniforms = np.array([rndClasses.RNG(self.get_patient_seed(i)).random_sample(2 * n_states)
+                             for i in range(first, end)])
+        if Data.ANTITHETIC_VARIATES:
+            if_odd = np.arange(first, end) % 2 == 1
+            uniforms[if_odd] = 1 - uniforms[if_odd]
+
+        states = np.array([s.value for s in self._patientInitialStates[first:end]], dtype=np.intp)
+        n_visits = np.zeros(n, dtype=np.intp)       # number of states each patient has left
+        exit_thresholds = uniforms[:, 0].copy()     # threshold to leave the current state
+        prob_staying = np.ones(n)                   # probability of still being in the current state
+        survival_cycles = np.full(n, -1)
+        AIDS_cycles = np.full(n, -1)
+        costs = np.zeros(n)
+        utilities = np.zeros(n)
+        # visited states and the time step each one was entered (to record trajectories)
+        visited_states = np.zeros((n, n_states), dtype=np.intp)
+        visited_states[:, 0] = states
+        visit_starts = np.zeros((n, n_states), dtype=np.intp)
+
+        alive = rows[~np.isin(states, DEATH_STATES)]
+        for k in range(stacked_params.get_n_cycles()):
+            if len(alive) == 0:
+                break
+
+            current_states = states[alive]
+            trans_probs = stacked_params.get_transition_probs(params[alive], current_states, k)
+            prob_stay = trans_probs[np.arange(len(alive)), current_states]
+
+            # patients stay while the probability of still being in the current state is above their threshold
+            prob_staying[alive] *= prob_stay
+            if_leaving = prob_staying[alive] <= exit_thresholds[alive]
+            next_states = current_states.copy()
+
+            if if_leaving.any():
+                leaving = alive[if_leaving]
+                # sample the next state from the transition probabilities to the other states
+                other_probs = trans_probs[if_leaving]
+                other_probs[np.arange(len(leaving)), current_states[if_leaving]] = 0
+                u = uniforms[leaving, 2 * n_visits[leaving] + 1] * (1 - prob_stay[if_leaving])
+                last_possible = n_states - 1 - np.argmax(other_probs[:, ::-1] > 0, axis=1)
+                next_states[if_leaving] = np.minimum(
+                    (np.cumsum(other_probs, axis=1) <= u[:, None]).sum(axis=1), last_possible)
+
+                # draw the threshold to leave the new state
+                n_visits[leaving] += 1
+                exit_thresholds[leaving] = uniforms[leaving, 2 * n_visits[leaving]]
+                prob_staying[leaving] = 1
+                visited_states[leaving, n_visits[leaving]] = next_states[if_leaving]
+                visit_starts[leaving, n_visits[leaving]] = k + 1
+
+            # collect outcomes
+            cost, utility = stacked_params.get_discounted_cost_utility(
+                params[alive], current_states, next_states, k)
+            costs[alive] += cost
+            utilities[alive] += utility
+            if_AIDS = (next_states == P.HealthStats.AIDS.value) & (current_states != P.HealthStats.AIDS.value)
+            AIDS_cycles[alive[if_AIDS]] = k
+            if_died = np.isin(next_states, DEATH_STATES)
+            survival_cycles[alive[if_died]] = k
+
+            states[alive] = next_states
+            alive = alive[~if_died]
+
+        # outcomes of each patient (events are recorded at the middle of their time step)
+        delta_t = Data.DELTA_T
+        for j in range(n):
+            if self._trajectories is not None:
+                self._trajectories.begin_patient(P.HealthStats(visited_states[j, 0]))
+                for v in range(1, n_visits[j] + 1):
+                    self._trajectories.record_transition(
+                        visit_starts[j, v] - 1, P.HealthStats(visited_states[j, v]))
+                self._trajectories.end_patient()
+
+            yield MarkovCls.PatientOutcomes(
+                survival_time=float((survival_cycles[j] + 0.5) * delta_t) if survival_cycles[j] >= 0 else None,
+                time_to_AIDS=float((AIDS_cycles[j] + 0.5) * delta_t) if AIDS_cycles[j] >= 0 else None,
+                cost=float(costs[j]),
+                utility=float(utilities[j]))
+
+    def get_input_hash(self):
+        """ :returns hash of the inputs that determine the outcomes of this cohort """
+        return Checkpoint.get_input_hash(
+            cohort_id=self._id, therapy=self._therapy, pop_size=self._initial_pop_size, subgroups=self._subgroups)
+
+    def get_subgroup_names(self):
+        return [g['name'] for g in self._subgroups]
+
+    def get_subgroup_outputs(self):
+        """ :returns list of the outputs of each subgroup (after the cohort is simulated) """
+
+        patients_by_subgroup = [[] for g in self._subgroups]
+        for patient, g in zip(self.get_patients(), self._patientSubgroups):
+            patients_by_subgroup[g].append(patient)
+
+        return [MarkovCls.CohortOutputs(_PatientGroup(patients)) for patients in patients_by_subgroup]
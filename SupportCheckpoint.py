@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import socket
+import numpy as np
+import InputData as Data
+import ParameterClasses as P
+
+
+# inputs that do not change the outcomes of simulated patients: the population size is passed as a setting
+# (patient ids depend on the population size of the cohort, not on Data.POP_SIZE), subgroups are passed as a
+# setting by cohorts made of subgroups, and the others only change how the simulation is run or reported
+NON_OUTCOME_INPUTS = ['POP_SIZE', 'ALPHA', 'CHECKPOINT_INTERVAL', 'SUBGROUPS', 'RECORD_TRAJECTORIES']
+
+
+def get_input_hash(**settings):
+    """
+    :param settings: additional settings that determine the outcomes (e.g. cohort id and therapy)
+    :returns hash of the values in InputData that determine the outcomes of simulated patients
+             and of the additional settings
+    """
+    inputs = {name: repr(getattr(Data, name)) for name in P.get_input_names()
+              if name not in NON_OUTCOME_INPUTS and not name.startswith('ADAPTIVE_')}
+    inputs.update({name: repr(value) for name, value in settings.items()})
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def get_range_path(directory, first_patient):
+    """ :returns path of the file of the range of patients starting from first_patient
+    in a directory of checkpoints """
+    return os.path.join(directory, 'patients_{:010d}.npz'.format(first_patient))
+
+
+def get_tmp_path(path):
+    """ :returns path of a temporary file to write before replacing the file at path
+    (unique to this node and process, so processes writing the same file never share a temporary file) """
+    return '{}.{}.{}.tmp'.format(path, socket.gethostname(), os.getpid())
+
+
+def _to_array(values):
+    """ :returns float array of the values (None is stored as nan) """
+    return np.array([np.nan if v is None else v for v in values], dtype=float)
+
+
+def _to_list(array):
+    """ :returns list of the values of a float array (nan is restored as None) """
+    return [None if np.isnan(v) else float(v) for v in array]
+
+
+def save_outcomes(path, patients, input_hash, first_patient=0):
+    """ saves the outcomes of a range of simulated patients
+    (the file is replaced atomically so an interrupted save leaves the previous file intact)
+    :param path: path of the file
+    :param patients: simulated patients (or patient outcomes) in the order of their index
+    :param input_hash: hash of the inputs the patients were simulated with
+    :param first_patient: index of the first patient
+    """
+
+    tmp_path = get_tmp_path(path)
+    with open(tmp_path, 'wb') as file:
+        np.savez(
+            file,
+            survival_times=_to_array([p.get_survival_time() for p in patients]),
+            times_to_AIDS=_to_array([p.get_time_to_AIDS() for p in patients]),
+            costs=_to_array([p.get_total_discounted_cost() for p in patients]),
+            utilities=_to_array([p.get_total_discounted_utility() for p in patients]),
+            # every patient seeds its random number generators from its index,
+            # so the index of the next patient determines the position of the random number streams
+            first_patient=first_patient,
+            next_patient=first_patient + len(patients),
+            input_hash=input_hash)
+    os.replace(tmp_path, path)
+
+
+def load_outcomes(path, input_hash=None):
+    """ loads the outcomes of a range of simulated patients
+    :param path: path of the file
+    :param input_hash: hash of the current inputs (if specified, it should match the hash saved in the file)
+    :returns (dictionary) with the index of the first and next patient and lists of
+             'survival_times', 'times_to_AIDS', 'costs', 'utilities'
+    """
+
+    with np.load(path) as file:
+        if input_hash is not None and str(file['input_hash']) != input_hash:
+            raise ValueError("'{}' was saved with different inputs.".format(path))
+
+        return {
+            'first_patient': int(file['first_patient']),
+            'next_patient': int(file['next_patient']),
+            'survival_times': _to_list(file['survival_times']),
+            'times_to_AIDS': _to_list(file['times_to_AIDS']),
+            'costs': [float(v) for v in file['costs']],
+            'utilities': [float(v) for v in file['utilities']],
+        }
@@ -6,6 +6,12 @@ import scr.StatisticalClasses as Stat
 import scr.EconEvalClasses as Econ
 
 
+def get_if_paired():
+    """ :returns True if outcomes of patients in the same position of different cohorts are paired
+    (they share parameter samples under PSA or random numbers under common random numbers) """
+    return Settings.PSA_ON or Settings.COMMON_RANDOM_NUMBERS
+
+
 def print_outcomes(simOutput, therapy_name):
     """ prints the outcomes of a simulated cohort
     :param simOutput: output of a simulated cohort
@@ -49,6 +55,29 @@ def print_outcomes(simOutput, therapy_name):
     print("")
 
 
+def print_adaptive_stopping(comparison):
+    """ prints the number of patients used by an adaptive comparison and if the target precision was reached
+    :param comparison: an adaptive comparison after being simulated
+    """
+    if comparison.get_if_converged():
+        print("Target precision reached after simulating", comparison.get_n_patients(), "patients per therapy.")
+    else:
+        print("Maximum of", comparison.get_n_patients(),
+              "patients per therapy simulated before reaching the target precision.")
+
+    # ICER estimate and confidence interval
+    for icer_stat in comparison.get_icer_stats():
+        icer_CI_text = F.format_estimate_interval(
+            estimate=icer_stat.get_ratio(),
+            interval=[icer_stat.get_ratio() - icer_stat.get_t_half_length(Settings.ALPHA),
+                      icer_stat.get_ratio() + icer_stat.get_t_half_length(Settings.ALPHA)],
+            deci=0,
+            form=F.FormatNumber.CURRENCY)
+        print("  Estimate of ICER and {:.{prec}%} confidence interval:".format(1 - Settings.ALPHA, prec=0),
+              icer_CI_text)
+    print("")
+
+
 def draw_survival_curves_and_histograms(simOutputs_mono, simOutputs_combo):
     """ draws the survival curves and the histograms of time until HIV deaths
     :param simOutputs_mono: output of a cohort simulated under mono therapy
@@ -96,7 +125,7 @@ def print_comparative_outcomes(simOutputs_mono, simOutputs_combo):
     """
 
     # increase in survival time under combination therapy with respect to mono therapy
-    if Settings.PSA_ON:
+    if get_if_paired():
         increase_survival_time = Stat.DifferenceStatPaired(
             name='Increase in survival time',
             x=simOutputs_combo.get_survival_times(),
@@ -117,16 +146,16 @@ def print_comparative_outcomes(simOutputs_mono, simOutputs_combo):
           estimate_CI)
 
     # increase in discounted total cost under combination therapy with respect to mono therapy
-    if Settings.PSA_ON:
+    if get_if_paired():
         increase_discounted_cost = Stat.DifferenceStatPaired(
             name='Increase in discounted cost',
-            x=simOutputs_combo.get_costs(),
-            y_ref=simOutputs_mono.get_costs())
+            x=simOutputs_combo.get_costs_for_CI(),
+            y_ref=simOutputs_mono.get_costs_for_CI())
     else:
         increase_discounted_cost = Stat.DifferenceStatIndp(
             name='Increase in discounted cost',
-            x=simOutputs_combo.get_costs(),
-            y_ref=simOutputs_mono.get_costs())
+            x=simOutputs_combo.get_costs_for_CI(),
+            y_ref=simOutputs_mono.get_costs_for_CI())
 
     # estimate and CI
     estimate_CI = F.format_estimate_interval(
@@ -139,16 +168,16 @@ def print_comparative_outcomes(simOutputs_mono, simOutputs_combo):
           estimate_CI)
 
     # increase in discounted total utility under combination therapy with respect to mono therapy
-    if Settings.PSA_ON:
+    if get_if_paired():
         increase_discounted_utility = Stat.DifferenceStatPaired(
             name='Increase in discounted utility',
-            x=simOutputs_combo.get_utilities(),
-            y_ref=simOutputs_mono.get_utilities())
+            x=simOutputs_combo.get_utilities_for_CI(),
+            y_ref=simOutputs_mono.get_utilities_for_CI())
     else:
         increase_discounted_utility = Stat.DifferenceStatIndp(
             name='Increase in discounted cost',
-            x=simOutputs_combo.get_utilities(),
-            y_ref=simOutputs_mono.get_utilities())
+            x=simOutputs_combo.get_utilities_for_CI(),
+            y_ref=simOutputs_mono.get_utilities_for_CI())
 
     # estimate and CI
     estimate_CI = F.format_estimate_interval(
@@ -169,17 +198,17 @@ def report_CEA_CBA(simOutputs_mono, simOutputs_combo):
     # define two strategies
     mono_therapy_strategy = Econ.Strategy(
         name='Mono Therapy',
-        cost_obs=simOutputs_mono.get_costs(),
-        effect_obs=simOutputs_mono.get_utilities()
+        cost_obs=simOutputs_mono.get_costs_for_CI(),
+        effect_obs=simOutputs_mono.get_utilities_for_CI()
     )
     combo_therapy_strategy = Econ.Strategy(
         name='Combination Therapy',
-        cost_obs=simOutputs_combo.get_costs(),
-        effect_obs=simOutputs_combo.get_utilities()
+        cost_obs=simOutputs_combo.get_costs_for_CI(),
+        effect_obs=simOutputs_combo.get_utilities_for_CI()
     )
 
     # CEA
-    if Settings.PSA_ON:
+    if get_if_paired():
         CEA = Econ.CEA(
             strategies=[mono_therapy_strategy, combo_therapy_strategy],
             if_paired=True
@@ -210,7 +239,7 @@ def report_CEA_CBA(simOutputs_mono, simOutputs_combo):
     )
 
     # CBA
-    if Settings.PSA_ON:
+    if get_if_paired():
         NBA = Econ.CBA(
             strategies=[mono_therapy_strategy, combo_therapy_strategy],
             if_paired=True
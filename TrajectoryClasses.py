@@ -0,0 +1,105 @@
+import math as math
+from array import array
+import numpy as np
+import InputData as Data
+import ParameterClasses as P
+
+
+class Trajectories:
+    """ health state paths of simulated patients stored as run-length segments (state, first time step, length)
+    in flat arrays shared by all patients, so storage grows with the number of transitions, not of time steps.
+    The path of every patient covers time steps 0, 1, ..., n_cycles (the last segment of a patient who died is
+    the death state until the end of the simulation). """
+    def __init__(self):
+
+        self._deltaT = Data.DELTA_T
+        self._nCycles = int(math.ceil(Data.SIM_LENGTH / Data.DELTA_T))
+
+        # time steps are stored as uint16 unless the simulation has too many cycles
+        step_type = 'H' if self._nCycles + 1 < 2**16 else 'I'
+
+        self._states = array('b')               # health state of each segment (int8)
+        self._starts = array(step_type)         # first time step of each segment
+        self._lengths = array(step_type)        # number of time steps of each segment
+        self._patientStarts = array('q')        # index of the first segment of each patient
+
+    def begin_patient(self, initial_state):
+        """ starts the path of a new patient
+        :param initial_state: health state of the patient at time step 0
+        """
+        self._patientStarts.append(len(self._states))
+        self._states.append(initial_state.value)
+        self._starts.append(0)
+
+    def record_transition(self, k, next_state):
+        """ records a change of health state
+        :param k: time step of the transition (the patient is in next_state from time step k+1)
+        :param next_state: new health state
+        """
+        self._lengths.append(k + 1 - self._starts[-1])
+        self._states.append(next_state.value)
+        self._starts.append(k + 1)
+
+    def end_patient(self):
+        """ closes the last segment of the current patient at the end of the simulation """
+        self._lengths.append(self._nCycles + 1 - self._starts[-1])
+
+    def get_n_patients(self):
+        return len(self._patientStarts)
+
+    def get_n_segments(self):
+        return len(self._lengths)
+
+    def get_segments(self, i):
+        """ :returns list of (state, first time step, length) segments of the i-th recorded patient """
+        first = self._patientStarts[i]
+        end = self._patientStarts[i + 1] if i + 1 < len(self._patientStarts) else len(self._lengths)
+        return [(P.HealthStats(self._states[j]), self._starts[j], self._lengths[j]) for j in range(first, end)]
+
+    def _get_arrays(self):
+        """ :returns numpy copies of the states, first time steps and lengths of closed segments """
+        n = len(self._lengths)
+        states = np.frombuffer(self._states, dtype=np.int8)[:n].astype(int)
+        starts = np.frombuffer(self._starts, dtype=self._starts.typecode).astype(int)[:n]
+        lengths = np.frombuffer(self._lengths, dtype=self._lengths.typecode).astype(int)
+        return states, starts, lengths
+
+    def get_occupancy(self):
+        """ :returns ((n_cycles+1) x states) array of the number of patients in each health state at each time step """
+
+        states, starts, lengths = self._get_arrays()
+
+        # add each segment at its first time step and remove it after its last time step
+        changes = np.zeros((self._nCycles + 2, len(P.HealthStats)), dtype=int)
+        np.add.at(changes, (starts, states), 1)
+        np.add.at(changes, (starts + lengths, states), -1)
+
+        return np.cumsum(changes, axis=0)[:-1]
+
+    def get_mean_sojourn_times(self):
+        """ :returns (dictionary) mean time (years) spent in each transient health state before leaving it
+        (segments still open at the end of the simulation are excluded) """
+
+        states, starts, lengths = self._get_arrays()
+        if_left = starts + lengths < self._nCycles + 1
+
+        mean_times = {}
+        for s in P.HealthStats:
+            if s not in [P.HealthStats.HIV_DEATH, P.HealthStats.BACKGROUND_DEATH]:
+                selected = if_left & (states == s.value)
+                mean_times[s] = lengths[selected].mean() * self._deltaT if selected.any() else None
+        return mean_times
+
+    def get_transition_counts(self):
+        """ :returns (states x states) array of the number of transitions from each health state to each other """
+
+        states, starts, lengths = self._get_arrays()
+
+        # consecutive segments of the same patient
+        if_first = np.zeros(len(states), dtype=bool)
+        if_first[np.frombuffer(self._patientStarts, dtype=np.int64)] = True
+        if_transition = ~if_first[1:]
+
+        counts = np.zeros((len(P.HealthStats), len(P.HealthStats)), dtype=int)
+        np.add.at(counts, (states[:-1][if_transition], states[1:][if_transition]), 1)
+        return counts